@@ -0,0 +1,159 @@
+# Times building the cards for a large snapshot of suggestions:
+#   python benchmarks/build_cards.py [--rows N] [--processes N] [--runs N]
+# The suggestions are generated the same way every run, in a temporary
+# directory. Cards are built in this process, in processes (which
+# cards.PARALLEL_BUILD turns on, and should only be if it's quicker), and with
+# processes which exit as soon as they start (on systems with a "false"
+# command), like when plover's python can't start plover_cards in a new
+# process. That should take about as long as building them here, and stop
+# trying processes after cards.MAX_PROCESS_FAILURES builds. Adding the cards to
+# Cards is timed too, as that's only done in this process
+import argparse
+import configparser
+from multiprocessing import resource_tracker
+import multiprocessing.spawn
+import os
+from pathlib import Path
+import random
+import shutil
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from plover_cards import config
+from plover_cards.card_builder import cards
+from plover_cards.plover_hook import card_suggestions as store
+from plover_cards.plover_hook import snapshot
+
+KEYS = "STKPWHRAO*EUFRPBLGTSDZ"
+
+
+def generate(count):
+    rng = random.Random(0)
+    for i in range(count):
+        strokes = {
+            "/".join(
+                "".join(sorted(rng.sample(KEYS, rng.randint(2, 6))))
+                for _ in range(rng.randint(1, 3))
+            ): rng.randint(1, 9)
+            for _ in range(rng.randint(1, 5))
+        }
+        yield (
+            f"word{i:07d}" + ("ing" if i % 7 == 0 else ""),
+            {
+                "frequency": rng.randint(1, 50),
+                "frequency_shorter": i % 3,
+                "last_updated": 1600000000.0 + i,
+                "strokes": strokes,
+            },
+        )
+
+
+class Generated(dict):
+    # snapshot.write only needs items, so they aren't all kept in memory
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+
+    def items(self):
+        return generate(self.count)
+
+
+def write_snapshot(directory, count):
+    source_path = Path(directory, "suggestions.pickle")
+    source_path.write_bytes(b"")
+    time.sleep(0.01)
+    path = Path(directory, "suggestions.snapshot")
+    snapshot.write(path, Generated(count), store.VERSION, store.HISTORY_DAYS)
+
+    return (path, source_path, Path(directory, "suggestions.deleted"))
+
+
+def build(paths, ignored):
+    snapshot.clear_deleted(paths[2])
+    card_suggestions = snapshot.Snapshot.open(*paths, store.VERSION)
+    try:
+        start = time.perf_counter()
+        (records, _ignored_phrases) = cards.create_cards(
+            card_suggestions, ignored, {}
+        )
+        return (time.perf_counter() - start, records)
+    finally:
+        card_suggestions.close()
+
+
+def append(records):
+    # what Cards does with the records once they're built
+    parser = configparser.ConfigParser()
+    config.reset(parser)
+    parser["compare_ignore"]["enabled"] = "no"
+    all_cards = cards.Cards(config.parse(parser), store.CardSuggestions())
+    start = time.perf_counter()
+    all_cards.append(records)
+    return time.perf_counter() - start
+
+
+def time_builds(name, paths, ignored, runs):
+    times = []
+    for _ in range(runs):
+        (seconds, records) = build(paths, ignored)
+        times.append(seconds)
+    print(
+        f"{name}: {min(times):.2f} s for {len(records)} cards,"
+        f" then {append(records):.2f} s adding them to Cards",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time building cards.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_snapshot(directory, args.rows)
+        ignored = {f"word{i:07d}" for i in range(0, args.rows, 20)}
+
+        with mock.patch.object(cards, "use_processes", return_value=False):
+            time_builds("in this process", paths, ignored, args.runs)
+
+        with mock.patch.object(
+            cards.os, "cpu_count", return_value=args.processes
+        ), mock.patch.object(cards, "PARALLEL_BUILD", True):
+            if args.rows < cards.PARALLEL_MIN_ROWS or args.processes < 2:
+                print("processes: not used for this many rows or processes")
+            else:
+                time_builds(f"{args.processes} processes", paths, ignored, args.runs)
+
+            if shutil.which("false") is None or args.processes < 2:
+                return
+
+            resource_tracker.ensure_running()
+            python = multiprocessing.spawn.get_executable()
+            multiprocessing.spawn.set_executable(shutil.which("false"))
+            try:
+                with mock.patch.object(
+                    cards, "PARALLEL_MIN_ROWS", 0
+                ), mock.patch.object(cards.log, "error"):
+                    for i in range(cards.MAX_PROCESS_FAILURES + 1):
+                        (seconds, records) = build(paths, ignored)
+                        # pylint: disable=protected-access
+                        failures = cards._process_failures["count"]
+                        print(
+                            f"processes which can't start, build {i + 1}:"
+                            f" {seconds:.2f} s for {len(records)} cards,"
+                            f" {failures} failure(s) so far",
+                            flush=True,
+                        )
+            finally:
+                multiprocessing.spawn.set_executable(python)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Times importing the modules plover loads when it starts:
+#   python benchmarks/import_time.py [--runs N]
+# Each import runs in a new process with python -X importtime and its own
+# temporary config directory, once with a plover_cards.cfg from an old version
+# (with [paths] and [anki] sections, while anki isn't running) and once with
+# the config already up to date. Check out an older commit and run it again to
+# compare
+import argparse
+import os
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import tempfile
+
+MODULES = [
+    "plover_cards.commands.anki_commands",
+    "plover_cards.plover_hook.plover_hook",
+]
+
+LEGACY_CONFIG = """\
+# written by an old version of plover_cards
+[paths]
+ignore = ignore.txt
+
+[anki]
+note_type = Basic
+"""
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def run_python(args, env):
+    return subprocess.run(
+        [sys.executable] + args,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+
+
+def import_once(module, env):
+    # (ms for the module including what it imports, ms for plover_cards's own
+    # modules, whether PyQt5 was imported, error)
+    result = run_python(
+        [
+            "-X",
+            "importtime",
+            "-c",
+            f"import sys, {module}; print('PyQt5' in sys.modules)",
+        ],
+        env,
+    )
+    if result.returncode != 0:
+        return (None, None, None, result.stderr.strip().splitlines()[-1])
+
+    cumulative = None
+    own = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        try:
+            (self_us, cumulative_us) = (int(parts[0]), int(parts[1]))
+        except ValueError:
+            # the header
+            continue
+        name = parts[2].strip()
+        if name.startswith("plover_cards"):
+            own += self_us
+        if name == module:
+            cumulative = cumulative_us
+
+    return (cumulative / 1000, own / 1000, result.stdout.strip() == "True", None)
+
+
+def time_imports(module, env, config_path, legacy, runs):
+    name = f"{module}, {'old' if legacy else 'current'} config"
+    times = []
+    own_times = []
+    writes = 0
+    imports_qt = False
+    for _ in range(runs):
+        if legacy:
+            config_path.write_text(LEGACY_CONFIG)
+        before = config_path.stat().st_mtime_ns
+        (cumulative, own, qt, error) = import_once(module, env)
+        if error is not None:
+            return f"{name}: {error}"
+
+        times.append(cumulative)
+        own_times.append(own)
+        imports_qt = imports_qt or qt
+        if config_path.stat().st_mtime_ns != before:
+            writes += 1
+
+    return (
+        f"{name}: {statistics.median(times):.1f} ms"
+        f" ({statistics.median(own_times):.1f} ms in plover_cards),"
+        f" config written {writes}/{runs} times,"
+        f" PyQt5 {'imported' if imports_qt else 'not imported'}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time plover_cards's imports.")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(
+            os.environ,
+            HOME=home,
+            XDG_CONFIG_HOME=str(Path(home, ".config")),
+            PYTHONPATH=os.pathsep.join(
+                [str(REPO_DIR)] + os.environ.get("PYTHONPATH", "").split(os.pathsep)
+            ),
+        )
+        config_dir = run_python(
+            ["-c", "from plover.oslayer.config import CONFIG_DIR; print(CONFIG_DIR)"],
+            env,
+        ).stdout.strip()
+        config_path = Path(config_dir, "plover_cards.cfg")
+        config_path.parent.mkdir(parents=True, exist_ok=True)
+
+        for module in MODULES:
+            for legacy in (True, False):
+                if not legacy:
+                    # written by the version being timed
+                    config_path.write_text("")
+                    run_python(
+                        ["-c", "from plover_cards import config; config.read()"], env
+                    )
+                print(
+                    time_imports(module, env, config_path, legacy, args.runs),
+                    flush=True,
+                )
+
+
+if __name__ == "__main__":
+    main()
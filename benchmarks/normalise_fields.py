@@ -0,0 +1,86 @@
+# Times removing html from anki fields when the card builder compares them with
+# suggestions:
+#   python benchmarks/normalise_fields.py [--fields N] [--runs N]
+# Each kind of field is generated the same way every run. "baseline" is how the
+# fields were normalised before html was removed, which only replaced &amp;,
+# &lt; and &gt;. Check out an older commit and run it again to compare
+import argparse
+from pathlib import Path
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from plover_cards.card_builder import cards
+from plover_cards.plover_hook import card_suggestions as store
+
+WORDS = ["go", "home", "Plover", "steno", "café", "let's"]
+FIELDS = {
+    "plain": WORDS,
+    # what anki's editor writes
+    "anki html": WORDS + ["&amp;", "&nbsp;", "&lt;", "<b>", "</b>", "<br>", "<div>"],
+    "other entities": WORDS + ["&amp;", "<b>", "</b>", "caf&eacute;", "&#x27;"],
+}
+
+BASELINE_REPLACEMENTS = [("&amp;", "&"), ("&gt;", ">"), ("&lt;", "<")]
+
+
+def baseline(values):
+    keys = []
+    for value in values:
+        for (find, replace) in BASELINE_REPLACEMENTS:
+            value = value.replace(find, replace)
+        keys.append(store.canonical(value.strip()))
+    return keys
+
+
+def one_at_a_time(values):
+    return cards.compare_keys(cards.normalise_field(value) for value in values)
+
+
+def batched(values):
+    return cards.compare_keys(cards.normalise_fields(values))
+
+
+def generate(words, count):
+    rng = random.Random(0)
+    return [
+        " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+        for _ in range(count)
+    ]
+
+
+def best_ms(func, values, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(values)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time normalising anki fields.")
+    parser.add_argument("--fields", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for (kind, words) in FIELDS.items():
+        values = generate(words, args.fields)
+        for func in (baseline, one_at_a_time, batched):
+            print(
+                f"{kind}, {func.__name__}: {best_ms(func, values, args.runs):.1f} ms"
+                f" for {args.fields} fields",
+                flush=True,
+            )
+
+    # suggestions aren't normalised, as they're already keyed like this
+    phrases = [store.canonical(phrase) for phrase in generate(WORDS, args.fields)]
+    ms = best_ms(cards.compare_keys, phrases, args.runs)
+    print(f"suggestions, compare_keys: {ms:.1f} ms for {args.fields} phrases")
+
+
+if __name__ == "__main__":
+    main()
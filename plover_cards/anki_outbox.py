@@ -0,0 +1,147 @@
+import json
+from pathlib import Path
+from threading import Condition, Thread, current_thread
+
+from plover import log
+from plover.oslayer.config import CONFIG_DIR as PLOVER_CONFIG_DIR
+
+from plover_cards import anki_utils
+
+# seconds to wait before trying again, doubling each time anki isn't available
+MIN_BACKOFF = 5
+MAX_BACKOFF = 300
+# requests sent together in one "multi" request
+BATCH_SIZE = 50
+
+
+class Outbox:
+    # requests that couldn't be sent because anki wasn't running. These are kept
+    # on disk and sent in the background once anki is available again
+    PATH = Path(PLOVER_CONFIG_DIR, "plover_cards", "anki_outbox.jsonl")
+
+    def __init__(self):
+        self.condition = Condition()
+        self.thread = None
+        self.running = False
+        self.requests = None
+
+    def __len__(self):
+        with self.condition:
+            self._load()
+            return len(self.requests)
+
+    def enqueue(self, action, **params):
+        with self.condition:
+            self._load()
+            request = anki_utils.request(action, **params)
+            self.requests.append(request)
+            self.PATH.parent.mkdir(parents=True, exist_ok=True)
+            with self.PATH.open("a") as f:
+                f.write(json.dumps(request))
+                f.write("\n")
+
+            self.condition.notify()
+
+        self.start()
+
+    def flush(self):
+        # returns False if anki isn't available
+        while True:
+            with self.condition:
+                self._load()
+                batch = self.requests[:BATCH_SIZE]
+            if len(batch) == 0:
+                return True
+
+            try:
+                # errors for single requests (e.g. a deleted deck) are returned in
+                # the results, and won't be fixed by sending them again
+                anki_utils.invoke("multi", actions=batch)
+            except OSError:
+                return False
+
+            with self.condition:
+                del self.requests[: len(batch)]
+                self._save()
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.thread = Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def _run(self):
+        try:
+            self._send_until_stopped()
+        finally:
+            # so start can start a new thread if this one stopped unexpectedly
+            with self.condition:
+                if self.thread is current_thread():
+                    self.running = False
+
+    def _send_until_stopped(self):
+        backoff = MIN_BACKOFF
+        while True:
+            with self.condition:
+                self._load()
+                while self._is_current() and len(self.requests) == 0:
+                    self.condition.wait()
+                if not self._is_current():
+                    return
+
+            try:
+                sent = self.flush()
+            except Exception:  # pylint: disable=broad-except
+                # e.g. anki connect answered with an error or something that
+                # isn't json, try again later
+                log.error("plover_cards: failed to send to anki", exc_info=True)
+                sent = False
+
+            if sent:
+                backoff = MIN_BACKOFF
+                continue
+
+            with self.condition:
+                self.condition.wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def _is_current(self):
+        # a thread started after this one was stopped takes over from it
+        return self.running and self.thread is current_thread()
+
+    def _load(self):
+        if self.requests is not None:
+            return
+
+        self.requests = []
+        if self.PATH.exists():
+            with self.PATH.open() as f:
+                for line in f:
+                    try:
+                        self.requests.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # the last line may be cut off if plover was killed
+                        continue
+
+    def _save(self):
+        if len(self.requests) == 0:
+            if self.PATH.exists():
+                self.PATH.unlink()
+            return
+
+        tmp_path = self.PATH.with_suffix(".tmp")
+        with tmp_path.open("w") as f:
+            for request in self.requests:
+                f.write(json.dumps(request))
+                f.write("\n")
+        tmp_path.replace(self.PATH)
+
+
+OUTBOX = Outbox()
@@ -1,16 +1,21 @@
 import json
-import urllib.request
+
+URL = "http://localhost:8765"
 
 
 def request(action, **params):
     return {"action": action, "params": params, "version": 6}
 
 
-def invoke(action, **params):
+def invoke(action, timeout=None, **params):
+    # slow to import, and plover loads the hook before anki is needed
+    import urllib.request  # pylint: disable=import-outside-toplevel
+
     request_json = json.dumps(request(action, **params)).encode("utf-8")
     response = json.load(
         urllib.request.urlopen(
-            urllib.request.Request("http://localhost:8765", request_json)
+            urllib.request.Request(URL, request_json),
+            timeout=timeout,
         )
     )
     if len(response) != 2:
@@ -24,13 +29,42 @@ def invoke(action, **params):
     return response["result"]
 
 
+# notes fetched or actions sent in each request, so big collections aren't sent
+# in one giant request
+BATCH_SIZE = 1000
+
+
 def get_notes(query):
     note_ids = invoke("findNotes", query=query)
-    notes = invoke("notesInfo", notes=note_ids)
+    notes = []
+    for start in range(0, len(note_ids), BATCH_SIZE):
+        notes.extend(invoke("notesInfo", notes=note_ids[start : start + BATCH_SIZE]))
 
     return notes
 
 
+def invoke_multi(actions, batch_size=BATCH_SIZE, on_progress=None):
+    # sends actions in batches of "multi" requests, returns how many were sent
+    # before anki stopped responding and [(index, error)] for the actions sent
+    # which anki couldn't do
+    errors = []
+    for start in range(0, len(actions), batch_size):
+        try:
+            results = invoke("multi", actions=actions[start : start + batch_size])
+        except OSError:
+            return (start, errors)
+
+        # each action's result is a response of its own, with its own error
+        for (i, result) in enumerate(results, start):
+            if isinstance(result, dict) and result.get("error") is not None:
+                errors.append((i, result["error"]))
+
+        if on_progress is not None:
+            on_progress(min(start + batch_size, len(actions)), len(actions))
+
+    return (len(actions), errors)
+
+
 def all_field_names():
     models = invoke("modelNames")
 
@@ -0,0 +1,218 @@
+# Records suggestions from old stroke logs:
+#   python -m plover_cards.backfill [--processes N] strokes.log [strokes.log ...]
+# Run this while plover is closed, otherwise the hook will overwrite the results
+# the next time it saves
+import argparse
+import ast
+import dataclasses
+from datetime import datetime
+from multiprocessing import Pool
+import re
+import time
+
+from plover import system
+from plover.config import Config
+from plover.dictionary.base import load_dictionary
+from plover.formatting import Formatter
+from plover.oslayer.config import CONFIG_FILE
+from plover.registry import registry
+from plover.steno import Stroke
+from plover.steno_dictionary import StenoDictionaryCollection
+from plover.suggestions import Suggestions
+from plover.translation import Translator
+
+from plover_cards import config
+from plover_cards.plover_hook import profiles
+from plover_cards.plover_hook.card_suggestions import CardSuggestions
+from plover_cards.plover_hook.plover_hook import Main
+
+# strokes sent to each worker at a time
+CHUNK_SIZE = 20000
+
+# e.g. "2021-05-25 10:00:00,123 Stroke(TKPWO : ['T-', 'K-', 'P-', 'W-', 'O-'])"
+STROKE_RX = re.compile(r"^(\S+ \S+) \*?Stroke\(.* : (\[.*\])\)$")
+
+_worker = {}
+
+
+class NullOutput:
+    def send_backspaces(self, _b):
+        pass
+
+    def send_string(self, _s):
+        pass
+
+    def send_key_combination(self, _c):
+        pass
+
+    def send_engine_command(self, _c):
+        pass
+
+
+class HeadlessEngine:
+    # just enough of plover's engine for the hook to run without plover
+    def __init__(self, dictionaries):
+        self.dictionaries = dictionaries
+        self.translator = Translator()
+        self.translator.set_dictionary(dictionaries)
+        self.translator.add_listener(self._on_translated)
+        self.formatter = Formatter()
+        self.formatter.set_output(NullOutput())
+        self.hooks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        pass
+
+    @property
+    def translator_state(self):
+        return self.translator.get_state()
+
+    def get_suggestions(self, translation):
+        return Suggestions(self.dictionaries).find(translation)
+
+    def hook_connect(self, hook, callback):
+        self.hooks.setdefault(hook, []).append(callback)
+
+    def hook_disconnect(self, hook, callback):
+        self.hooks[hook].remove(callback)
+
+    def _on_translated(self, old, new, prev=None):
+        self.formatter.format(old, new, prev)
+        for callback in self.hooks.get("translated", []):
+            callback(old, new)
+
+
+def load_plover_config():
+    plover_config = Config(CONFIG_FILE)
+    plover_config.load()
+    registry.update()
+    return plover_config
+
+
+def load_dictionaries():
+    plover_config = load_plover_config()
+    system.setup(plover_config["system_name"])
+
+    dictionaries = []
+    for dictionary_config in plover_config["dictionaries"]:
+        dictionary = load_dictionary(dictionary_config.path)
+        dictionary.enabled = dictionary_config.enabled
+        dictionaries.append(dictionary)
+
+    return StenoDictionaryCollection(dictionaries)
+
+
+def parse_line(line):
+    match = STROKE_RX.match(line.strip())
+    if match is None:
+        return None
+
+    timestamp = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S,%f")
+    return (timestamp.timestamp(), ast.literal_eval(match.group(2)))
+
+
+def read_chunks(paths):
+    chunk = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                chunk.append(line)
+                if len(chunk) >= CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _init_worker():
+    engine = HeadlessEngine(load_dictionaries())
+    hook = Main(engine, CardSuggestions(load=False))
+    # record every stroke, there's no need to keep up with typing
+    hook.settings = dataclasses.replace(hook.settings, sample_every=1, high_wpm=0)
+    hook.outline_index.update(engine.dictionaries)
+    # pylint: disable=protected-access
+    engine.hook_connect("translated", hook._on_translated)
+
+    _worker["engine"] = engine
+    _worker["hook"] = hook
+
+
+def _replay(lines):
+    engine = _worker["engine"]
+    hook = _worker["hook"]
+
+    # chunks aren't in order, so don't carry over translations from the last one
+    engine.translator.clear_state()
+    num_strokes = 0
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is None:
+            continue
+
+        (timestamp, keys) = parsed
+        try:
+            stroke = Stroke(keys)
+        except ValueError:
+            # logged with a different steno system
+            continue
+
+        hook.clock = lambda timestamp=timestamp: timestamp
+        engine.translator.translate(stroke)
+        num_strokes += 1
+
+    hook.flush()
+    result = hook.card_suggestions.card_suggestions
+    hook.card_suggestions.card_suggestions = {}
+
+    return (num_strokes, result)
+
+
+def backfill(paths, processes=None):
+    config.CONFIG.get()
+    # recorded for the system and dictionaries plover is set up with
+    profile = profiles.from_config(load_plover_config())
+    profiles.remember(profile)
+    card_suggestions = CardSuggestions(profile)
+
+    start = time.time()
+    num_strokes = 0
+    with Pool(processes, initializer=_init_worker) as pool:
+        for (chunk_strokes, result) in pool.imap_unordered(_replay, read_chunks(paths)):
+            card_suggestions.merge(result)
+            num_strokes += chunk_strokes
+            elapsed = time.time() - start
+            print(
+                f"{num_strokes} strokes, {num_strokes / elapsed:.0f} strokes/s",
+                flush=True,
+            )
+
+    card_suggestions.save()
+
+    return num_strokes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Record suggestions from Plover stroke logs."
+    )
+    parser.add_argument("paths", nargs="+", help="stroke log files")
+    parser.add_argument(
+        "--processes", type=int, default=None, help="defaults to the number of CPUs"
+    )
+    args = parser.parse_args()
+
+    start = time.time()
+    num_strokes = backfill(args.paths, args.processes)
+    elapsed = time.time() - start
+    print(
+        f"Replayed {num_strokes} strokes in {elapsed:.1f}s "
+        f"({num_strokes / max(elapsed, 0.001):.0f} strokes/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
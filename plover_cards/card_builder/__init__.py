@@ -0,0 +1,5 @@
+# Only the card builder tool's modules (card_builder, card_table_model, review
+# and utils) import PyQt5. They subclass Qt classes, so it's imported at the top,
+# and plover has already imported it for its gui before loading the tool. The
+# hook, ANKI_ADD_CARD, backfill and the processes building cards only import
+# cards, scoring, output_csv and session, so they never import PyQt5
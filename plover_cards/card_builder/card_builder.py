@@ -7,35 +7,59 @@ from plover.gui_qt.tool import Tool
 
 from plover_cards import anki_utils
 from plover_cards import config
-from plover_cards.plover_hook.card_suggestions import CardSuggestions
+from plover_cards.plover_hook import card_suggestions as store
+from plover_cards.plover_hook import profiles
+from plover_cards.plover_hook.snapshot import Snapshot
 
 from .cards import Cards
 from .card_builder_ui import Ui_CardBuilder
 from .card_table_model import COLUMNS, CardTableModel
+from .review import ReviewEngine
+from .session import ReviewSession
 from . import utils
 
+# seconds between checking if the ignore file or suggestions have changed
+WATCH_INTERVAL = 2
+
 
 class CardBuilder(Tool, Ui_CardBuilder):
     TITLE = "Card Builder"
     ICON = ":/plover_cards/cards.svg"
     ROLE = "cardbuilder"
 
+    config_changed = QtCore.pyqtSignal(object)
+
     def __init__(self, engine):
         super().__init__(engine)
         self.engine = engine
 
-        hook = self.engine._running_extensions.get("plover_cards_hook")
-        if hook:
-            self.card_suggestions = hook.card_suggestions
-            self.card_suggestions.save()
-        else:
-            self.card_suggestions = CardSuggestions()
+        self.hook = self.engine._running_extensions.get("plover_cards_hook")
+        # opened when the cards are built, from the chosen profiles
+        self.card_suggestions = None
+        self.store_profiles = []
+        self.live_store = False
 
         self.setupUi(self)
+        self.finished.connect(self.close_store)
 
-        self.config = config.read()
+        try:
+            config.CONFIG.migrate_anki()
+        except Exception:
+            # anki isn't running, try again next time
+            pass
+        self.settings = config.CONFIG.get()
+        # the settings page changes a copy, which is saved when the cards are built
+        self.config = config.CONFIG.copy()
+
+        self.config_loaders = []
+        self.config_changed.connect(self.on_config_changed)
+        config.CONFIG.subscribe(self.config_changed.emit)
+        self.finished.connect(
+            lambda: config.CONFIG.unsubscribe(self.config_changed.emit)
+        )
 
         self.setup_settings()
+        self.config_values = config.as_dict(self.config)
         self.setup_buttons()
         self.setup_suggestions()
         self.custom_strokes.textChanged.connect(self.on_custom_stroke)
@@ -43,6 +67,11 @@ class CardBuilder(Tool, Ui_CardBuilder):
         self.current_card_index = 0
         self.cards = None
         self.card_view_model = None
+        self.review = None
+        self.session = None
+        self.ignore_mtime = None
+        self.store_version = None
+        self.watch_timer = None
 
         self.pages.setCurrentIndex(0)
         self.start.setFocus()
@@ -50,14 +79,18 @@ class CardBuilder(Tool, Ui_CardBuilder):
 
     def config_connect(self, widget, section, option, radio_value=None):
         if isinstance(widget, QtWidgets.QLineEdit):
-            widget.setText(self.config.get(section, option))
+
+            def load_config():
+                widget.setText(self.config.get(section, option))
 
             def update_config(new_text):
                 self.config[section][option] = new_text
 
             widget.textChanged.connect(update_config)
         elif isinstance(widget, QtWidgets.QCheckBox):
-            widget.setChecked(self.config.getboolean(section, option))
+
+            def load_config():
+                widget.setChecked(self.config.getboolean(section, option))
 
             def update_config():
                 if widget.isChecked():
@@ -67,7 +100,9 @@ class CardBuilder(Tool, Ui_CardBuilder):
 
             widget.stateChanged.connect(update_config)
         elif isinstance(widget, QtWidgets.QComboBox):
-            widget.setCurrentText(self.config.get(section, option))
+
+            def load_config():
+                widget.setCurrentText(self.config.get(section, option))
 
             def update_config(new_text):
                 if new_text != "":
@@ -75,10 +110,12 @@ class CardBuilder(Tool, Ui_CardBuilder):
 
             widget.currentTextChanged.connect(update_config)
         elif isinstance(widget, QtWidgets.QRadioButton):
-            if self.config.get(section, option) == radio_value:
-                widget.setChecked(True)
-            else:
-                widget.setChecked(False)
+
+            def load_config():
+                if self.config.get(section, option) == radio_value:
+                    widget.setChecked(True)
+                else:
+                    widget.setChecked(False)
 
             def update_config():
                 if widget.isChecked():
@@ -88,14 +125,49 @@ class CardBuilder(Tool, Ui_CardBuilder):
         else:
             raise Exception(f"unknown widget type for {widget}")
 
+        load_config()
+        self.config_loaders.append(load_config)
+
+    def on_config_changed(self, settings):
+        self.settings = settings
+        # changes which haven't been saved yet aren't replaced by the file's
+        if (
+            self.pages.currentIndex() == 0
+            and config.as_dict(self.config) == self.config_values
+        ):
+            self.config = config.CONFIG.copy()
+            for load_config in self.config_loaders:
+                load_config()
+            self.config_values = config.as_dict(self.config)
+
+    def setup_profiles(self):
+        self.profile.addItem("Current system and dictionaries", profiles.CURRENT)
+        for profile in profiles.load_all():
+            self.profile.addItem(profile.name, profile.key)
+        self.profile.addItem("All", profiles.ALL)
+
+        def load_config():
+            index = self.profile.findData(self.config.get("suggestions", "profile"))
+            self.profile.setCurrentIndex(max(index, 0))
+
+        def update_config(index):
+            self.config["suggestions"]["profile"] = self.profile.itemData(index)
+
+        self.profile.currentIndexChanged.connect(update_config)
+        load_config()
+        self.config_loaders.append(load_config)
+
     def setup_settings(self):
         # connect to config
+        self.setup_profiles()
         self.config_connect(self.use_ignore, "compare_ignore", "enabled")
         self.config_connect(self.ignore_path, "compare_ignore", "file_path")
 
         self.config_connect(self.compare_to_anki, "compare_to_anki", "enabled")
         self.config_connect(self.anki_query, "compare_to_anki", "query")
         self.config_connect(self.anki_compare_field, "compare_to_anki", "compare_field")
+        self.config_connect(self.update_strokes, "compare_to_anki", "update_strokes")
+        self.config_connect(self.anki_strokes_field, "compare_to_anki", "strokes_field")
 
         self.config_connect(self.output_to_csv, "output_csv", "enabled")
         self.config_connect(self.output_path, "output_csv", "file_path")
@@ -122,8 +194,13 @@ class CardBuilder(Tool, Ui_CardBuilder):
                 self.anki_query,
                 self.anki_compare_field_label,
                 self.anki_compare_field,
+                self.update_strokes,
             ],
         )
+        utils.setup_checkbox_section(
+            self.update_strokes,
+            [self.anki_strokes_field_label, self.anki_strokes_field],
+        )
         utils.setup_checkbox_section(
             self.output_to_csv,
             [
@@ -190,6 +267,15 @@ class CardBuilder(Tool, Ui_CardBuilder):
             ),
             self.deck.clear,
         )
+        utils.on_checkbox(
+            self.compare_to_anki,
+            lambda: utils.combobox_set_items(
+                self.anki_strokes_field,
+                anki_utils.all_field_names(),
+                self.config["compare_to_anki"]["strokes_field"],
+            ),
+            self.anki_strokes_field.clear,
+        )
         utils.on_checkbox(
             self.add_to_anki,
             lambda: utils.combobox_set_items(
@@ -240,8 +326,39 @@ class CardBuilder(Tool, Ui_CardBuilder):
         self.suggestions.setModel(self.suggestions_model)
         self.suggestions.clicked.connect(self.on_suggestion_click)
 
+    def open_store(self):
+        choice = self.settings.suggestions.profile
+        if choice == profiles.ALL:
+            self.store_profiles = profiles.load_all()
+        else:
+            profile = profiles.find(choice)
+            self.store_profiles = [] if profile is None else [profile]
+        if len(self.store_profiles) == 0:
+            profile = profiles.from_config(self.engine.config)
+            profiles.remember(profile)
+            self.store_profiles = [profile]
+
+        live = None if self.hook is None else self.hook.card_suggestions
+        self.live_store = live is not None and self.store_profiles == [live.profile]
+        if self.live_store:
+            live.save()
+            self.card_suggestions = live
+        else:
+            self.read_store()
+
+    def read_store(self):
+        if len(self.store_profiles) == 1:
+            self.card_suggestions = store.read_only(self.store_profiles[0])
+        else:
+            live = None if self.hook is None else self.hook.card_suggestions
+            self.card_suggestions = store.read_all(self.store_profiles, live)
+
     def setup_cards(self):
-        self.cards = Cards(self.config, self.card_suggestions)
+        self.open_store()
+        self.session = ReviewSession(profile.key for profile in self.store_profiles)
+        self.cards = Cards(self.settings, self.card_suggestions, self.session)
+
+        self.review = ReviewEngine(self.cards, self)
 
         self.card_view_model = CardTableModel(self.card_view)
         self.card_view_model.set_cards_(self.cards)
@@ -252,12 +369,20 @@ class CardBuilder(Tool, Ui_CardBuilder):
         header.customContextMenuRequested.connect(self.show_header_menu)
         self.card_view.clicked.connect(self.on_card_click)
 
+        if self.session.sort is not None:
+            (column, order) = self.session.sort
+            self.card_view.sortByColumn(column, QtCore.Qt.SortOrder(order))
+        if self.session.resumed and self.session.current is not None:
+            # the card may have been ignored or removed since
+            self.current_card_index = self.cards.index(self.session.current) or 0
+        header.sortIndicatorChanged.connect(self.session.record_sort)
+
         self.num_ignored.setText(f"{self.cards.num_ignored} ignored")
 
-        if not self.config.getboolean("compare_ignore", "enabled"):
+        if not self.settings.compare_ignore.enabled:
             self.ignore_card.hide()
 
-            if not self.config.getboolean("compare_to_anki", "enabled"):
+            if not self.settings.compare_to_anki.enabled:
                 index = next(
                     i
                     for i, col in enumerate(COLUMNS)
@@ -265,6 +390,99 @@ class CardBuilder(Tool, Ui_CardBuilder):
                 )
                 header.hideSection(index)
 
+    def setup_watch(self):
+        # the hook keeps recording suggestions and the ignore file can be edited
+        # while cards are being built. This polls rather than using
+        # QFileSystemWatcher, which stops watching files that are replaced
+        self.ignore_mtime = utils.mtime(self.settings.compare_ignore.file_path)
+        self.store_version = self.get_store_version()
+
+        self.watch_timer = QtCore.QTimer(self)
+        self.watch_timer.setInterval(WATCH_INTERVAL * 1000)
+        self.watch_timer.timeout.connect(self.on_watch)
+        self.watch_timer.start()
+        self.finished.connect(self.watch_timer.stop)
+
+    def get_store_version(self):
+        if self.live_store:
+            return self.card_suggestions.generation
+        return tuple(
+            utils.mtime(profile.path(".pickle")) for profile in self.store_profiles
+        )
+
+    def close_store(self):
+        if isinstance(self.card_suggestions, (Snapshot, store.CombinedSuggestions)):
+            self.card_suggestions.close()
+        elif self.card_suggestions is not None and (
+            self.hook is None
+            or self.hook.card_suggestions.profile != self.card_suggestions.profile
+        ):
+            # the hook isn't going to save it, e.g. it's moved on to another
+            # profile since the cards were built
+            self.card_suggestions.close()
+
+    def on_watch(self):
+        self.check_ignore_file()
+
+        store_version = self.get_store_version()
+        if store_version != self.store_version:
+            self.update_cards(self.store_version)
+            self.store_version = store_version
+
+    def check_ignore_file(self):
+        if self.settings.compare_ignore.enabled:
+            ignore_mtime = utils.mtime(self.settings.compare_ignore.file_path)
+            if ignore_mtime != self.ignore_mtime:
+                self.ignore_mtime = ignore_mtime
+                self.remove_cards(self.cards.reload_ignored(self.card_suggestions))
+
+    def update_cards(self, store_version):
+        if self.live_store:
+            phrases = self.card_suggestions.updated_since(store_version)
+        else:
+            # saved by something else, e.g. the hook after it was enabled
+            self.close_store()
+            self.read_store()
+            frequencies = {
+                store.canonical(card.translation): card.frequency for card in self.cards
+            }
+            phrases = [
+                phrase
+                for phrase, data in self.card_suggestions.items()
+                if frequencies.get(phrase) != data["frequency"]
+            ]
+
+        (updated, new_records) = self.cards.merge_changes(
+            self.card_suggestions, phrases
+        )
+        for i in updated:
+            self.review.forget(self.cards[i].translation)
+            self.card_view_model.refresh_(i)
+        was_empty = len(self.cards) == 0
+        self.card_view_model.append_cards_(new_records)
+
+        self.num_ignored.setText(f"{self.cards.num_ignored} ignored")
+        if len(self.cards) > 0 and (was_empty or self.current_card_index in updated):
+            self.show_card()
+        elif len(self.cards) > 0:
+            self.update_progress()
+
+    def remove_cards(self, card_indexes):
+        if len(card_indexes) == 0:
+            return
+
+        before = sum(1 for i in card_indexes if i < self.current_card_index)
+        self.card_view_model.remove_cards_(card_indexes)
+        self.current_card_index = max(
+            min(self.current_card_index - before, len(self.cards) - 1), 0
+        )
+
+        self.num_ignored.setText(f"{self.cards.num_ignored} ignored")
+        if len(self.cards) > 0:
+            self.show_card()
+        else:
+            self.review.prefetch(0)
+
     def show_header_menu(self, position):
         menu = QtWidgets.QMenu()
         header = self.card_view.horizontalHeader()
@@ -286,7 +504,7 @@ class CardBuilder(Tool, Ui_CardBuilder):
         menu.exec_(self.card_view.mapToGlobal(position))
 
     def on_start(self):
-        config.save(self.config)
+        config.CONFIG.save(self.config)
 
         self.setup_cards()
 
@@ -294,6 +512,8 @@ class CardBuilder(Tool, Ui_CardBuilder):
         if len(self.cards) > 0:
             self.show_card()
 
+        self.setup_watch()
+
     def show_card(self):
         if self.current_card_index == 0:
             self.prev_card.setEnabled(False)
@@ -307,9 +527,7 @@ class CardBuilder(Tool, Ui_CardBuilder):
             self.next_card.setEnabled(True)
             self.next_card.setFocus()
 
-        self.progress.setText(
-            f"Suggestion {self.current_card_index + 1} of {len(self.cards)}"
-        )
+        self.update_progress()
         self.card_view.setCurrentIndex(
             self.card_view_model.index(self.current_card_index, 0)
         )
@@ -318,16 +536,11 @@ class CardBuilder(Tool, Ui_CardBuilder):
 
         self.translation.setText(card.translation)
 
-        self.suggestions_model.clear()
+        (model, rows) = self.review.model(card)
+        self.set_suggestions_model(model)
         self.custom_strokes.setText("")
-        for suggestion in card.stroke_suggestions:
-            item = QtGui.QStandardItem(suggestion)
-            item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
-            self.suggestions_model.appendRow(item)
-            if suggestion == card.chosen_strokes:
-                self.suggestions.setCurrentIndex(
-                    self.suggestions_model.indexFromItem(item)
-                )
+        if card.chosen_strokes in rows:
+            self.suggestions.setCurrentIndex(model.index(rows[card.chosen_strokes], 0))
 
         if not card.ignored and card.chosen_strokes is None:
             index = self.suggestions_model.index(0, 0)
@@ -342,6 +555,25 @@ class CardBuilder(Tool, Ui_CardBuilder):
 
         self.suggestions.show()
 
+        self.review.prefetch(self.current_card_index)
+        self.session.record_current(card.translation)
+
+    def update_progress(self):
+        self.progress.setText(
+            f"Suggestion {self.current_card_index + 1} of {len(self.cards)}"
+        )
+        self.next_card.setEnabled(self.current_card_index < len(self.cards) - 1)
+
+    def set_suggestions_model(self, model):
+        if self.suggestions_model is model:
+            return
+
+        selection_model = self.suggestions.selectionModel()
+        self.suggestions_model = model
+        self.suggestions.setModel(model)
+        # setModel doesn't delete the old selection model
+        selection_model.deleteLater()
+
     def on_prev_card(self):
         self.current_card_index -= 1
         self.show_card()
@@ -384,17 +616,52 @@ class CardBuilder(Tool, Ui_CardBuilder):
         self.show_card()
 
     def on_finish(self):
-        self.cards.save()
+        # the ignore file is written when saving, so don't lose anything added
+        # to it since it was last polled
+        self.check_ignore_file()
+        if self.cards.note_updates:
+            progress = QtWidgets.QProgressDialog(
+                "Updating notes in Anki", None, 0, len(self.cards.note_updates), self
+            )
+            progress.setWindowModality(QtCore.Qt.WindowModal)
+            progress.setMinimumDuration(0)
+
+            def on_progress(done, _total):
+                progress.setValue(done)
+                QtWidgets.QApplication.processEvents()
+
+            self.cards.save(on_progress)
+            progress.close()
+        else:
+            self.cards.save()
+
+        self.session.clear()
         self.close()
 
         message = []
-        if self.config.getboolean("add_to_anki", "enabled"):
+        if self.cards.note_updates:
+            message.append(f"{self.cards.num_updated} note(s) updated in anki")
+            if self.cards.update_errors:
+                message.append(
+                    f"{len(self.cards.update_errors)} note(s) couldn't be updated:"
+                    f" {self.cards.update_errors[0]}"
+                )
+            if self.cards.num_updates_queued > 0:
+                message.append(
+                    f"{self.cards.num_updates_queued} note(s) will be updated when anki"
+                    " is running"
+                )
+        if self.settings.add_to_anki.enabled:
             message.append(f"{self.cards.num_added} note(s) added to anki")
-        if self.config.getboolean("output_csv", "enabled"):
+            if self.cards.num_queued > 0:
+                message.append(
+                    f"{self.cards.num_queued} note(s) will be added when anki is running"
+                )
+        if self.settings.output_csv.enabled:
             message.append(
-                f"{self.cards.num_saved} note(s) saved to {self.config['output_csv']['file_path']}"
+                f"{self.cards.num_saved} note(s) saved to {self.settings.output_csv.file_path}"
             )
-        if self.config.getboolean("compare_ignore", "enabled"):
+        if self.settings.compare_ignore.enabled:
             message.append(
                 f"{len(self.cards.new_ignored)} entries added to ignore file"
             )
@@ -414,6 +681,7 @@ if __name__ == "__main__":
     class EngineMock:
         def __init__(self):
             self._running_extensions = {}
+            self.config = {"system_name": "English Stenotype", "dictionaries": []}
 
     app = QtWidgets.QApplication([])
     dialog = CardBuilder(EngineMock())
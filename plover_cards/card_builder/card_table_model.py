@@ -1,15 +1,25 @@
 from PyQt5 import QtCore
 
+from .cards import RECENT_DAYS
+
 COLUMNS = [
     {
         "name": "Count",
         "value": lambda card: card.frequency,
         "sort_key": lambda card: card.frequency,
+        "sort": lambda cards, reverse: cards.sort_by(cards.frequency, reverse),
     },
     {
         "name": "Count\n(shorter)",
         "value": lambda card: card.frequency_shorter,
         "sort_key": lambda card: card.frequency_shorter,
+        "sort": lambda cards, reverse: cards.sort_by(cards.frequency_shorter, reverse),
+    },
+    {
+        "name": f"Count\n({RECENT_DAYS} days)",
+        "value": lambda card: card.recent_frequency,
+        "sort_key": lambda card: card.recent_frequency,
+        "sort": lambda cards, reverse: cards.sort_by(cards.recent_frequency, reverse),
     },
     {
         "name": "Last Used",
@@ -19,6 +29,13 @@ COLUMNS = [
         if card.last_updated
         else "",
         "sort_key": lambda card: card.last_updated if card.last_updated else 0,
+        "sort": lambda cards, reverse: cards.sort_by(cards.last_updated, reverse),
+    },
+    {
+        "name": "Priority",
+        "value": lambda card: f"{card.priority:.1f}",
+        "sort_key": lambda card: card.priority,
+        "sort": lambda cards, reverse: cards.sort_by(cards.priority, reverse),
     },
     {
         "name": "Translation",
@@ -54,6 +71,29 @@ class CardTableModel(QtCore.QAbstractTableModel):
             self.index(card_index, self.columnCount()),
         )
 
+    def append_cards_(self, records):
+        if len(records) == 0:
+            return
+
+        start = len(self.cards)
+        self.beginInsertRows(QtCore.QModelIndex(), start, start + len(records) - 1)
+        self.cards.append(records)
+        self.endInsertRows()
+
+    def remove_cards_(self, card_indexes):
+        # removed from the end so the indexes of the rest don't change, in
+        # ranges so neighbouring rows only need one signal
+        card_indexes = sorted(card_indexes, reverse=True)
+        while card_indexes:
+            last = card_indexes.pop(0)
+            first = last
+            while card_indexes and card_indexes[0] == first - 1:
+                first = card_indexes.pop(0)
+
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            self.cards.remove(range(first, last + 1))
+            self.endRemoveRows()
+
     def rowCount(self, _parent=None):  # pylint: disable=invalid-name
         return len(self.cards)
 
@@ -74,9 +114,11 @@ class CardTableModel(QtCore.QAbstractTableModel):
         return COLUMNS[column]["name"]
 
     def sort(self, column, order=QtCore.Qt.AscendingOrder):
-        self.cards.sort(
-            key=COLUMNS[column]["sort_key"], reverse=order == QtCore.Qt.DescendingOrder
-        )
+        reverse = order == QtCore.Qt.DescendingOrder
+        if "sort" in COLUMNS[column]:
+            COLUMNS[column]["sort"](self.cards, reverse)
+        else:
+            self.cards.sort(key=COLUMNS[column]["sort_key"], reverse=reverse)
         self.dataChanged.emit(
             self.index(0, 0),
             self.index(self.rowCount(), self.columnCount()),
@@ -1,28 +1,176 @@
-import csv
-from dataclasses import dataclass, field
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import gc
+import html
+import multiprocessing
+import os
 from pathlib import Path
+import pickle
 import re
-from typing import List
-
-from plover_cards import anki_utils
-
-NOTE_REPLACEMENTS = [
-    ("&amp;", "&"),
-    ("&gt;", ">"),
-    ("&lt;", "<"),
-]
+import sys
+import tempfile
+import time
 
+from plover import log
 
-def normalise_text(text):
-    for find, replace in NOTE_REPLACEMENTS:
-        text = text.replace(find, replace)
-    return text.strip()
-
-
-def get_existing_notes(query, compare_field):
-    notes = anki_utils.get_notes(query)
+from plover_cards import anki_utils
+from plover_cards.anki_outbox import OUTBOX
+from plover_cards.plover_hook import card_suggestions as store
+from plover_cards.plover_hook.snapshot import Snapshot
+from .output_csv import OutputCsv
+from . import scoring
+
+# the "recent" count is for this many days
+RECENT_DAYS = 7
+# building cards in processes is off, as it hasn't been measured to be quicker:
+# the cards are still sent back and added to Cards in this process, which is at
+# least half of the work. benchmarks/build_cards.py times it on a machine with
+# more than one CPU
+PARALLEL_BUILD = False
+# snapshots with at least this many rows are split between processes, smaller
+# ones are quicker to build than to start the processes for
+PARALLEL_MIN_ROWS = 200000
+# rows given to a process at a time
+PARALLEL_CHUNK_ROWS = 25000
+# after building cards in processes has failed this many times, they're only
+# built in plover's process
+MAX_PROCESS_FAILURES = 2
+# Cards.chosen for cards without chosen strokes
+NO_STROKES = 0xFFFFFFFF
+# Cards.strokes has "stroke\tcount\tstroke\tcount..." for each row, like
+# snapshots do
+STROKES_SEPARATOR = "\t"
+# rows left in the columns by updated and removed cards are dropped once there
+# are more of them than cards, and at least this many
+MIN_ROWS_TO_COMPACT = 1000
+# what's kept of Cards in a review session
+CARD_COLUMNS = (
+    "translations",
+    "translation_offsets",
+    "strokes",
+    "stroke_offsets",
+    "frequency",
+    "frequency_shorter",
+    "recent_frequency",
+    "last_updated",
+    "priority",
+    "chosen",
+    "is_ignored",
+    "similar_ignored",
+    "strings",
+    "order",
+)
+
+# html in anki fields, e.g. "<b>go</b><br>home&nbsp;&amp;". Tags, entities
+# (like html.unescape finds them) and non-breaking spaces are replaced in one
+# pass, so "&amp;lt;" becomes "&lt;" rather than "<"
+HTML_RX = re.compile(
+    r"<[^<>\x00]*>|&(?:#[0-9]+;?|#[xX][0-9a-fA-F]+;?|[^\t\n\f <&#;\x00]{1,32};?)|\xa0"
+)
+LINE_BREAK_RX = re.compile(r"<br\b", re.IGNORECASE)
+# the same tags and entities come up over and over, so their replacements are
+# kept, up to this many
+MAX_HTML_REPLACEMENTS = 10000
+# fields are normalised together, joined by this
+SEPARATOR = "\x00"
+
+_worker = {}
+# tag or entity: replacement
+_html_replacements = {}
+# how many times building cards in processes has failed
+_process_failures = {"count": 0}
+
+
+def normalise_fields(values):
+    # the text of anki fields without html. Going over all of them at once is
+    # much quicker than a field at a time
+    values = list(values)
+    joined = SEPARATOR.join(values)
+    if joined.count(SEPARATOR) != max(len(values) - 1, 0):
+        return [normalise_field(value) for value in values]
+
+    # finding these characters is much quicker than the regex not matching
+    if "<" in joined or "&" in joined or "\xa0" in joined:
+        joined = HTML_RX.sub(replace_html, joined)
+
+    return [value.strip() for value in joined.split(SEPARATOR)]
+
+
+def normalise_field(value):
+    return HTML_RX.sub(replace_html, value).strip()
+
+
+def replace_html(match):
+    try:
+        return _html_replacements[match[0]]
+    except KeyError:
+        pass
+
+    text = match[0]
+    if text[0] == "&":
+        replacement = html.unescape(text).replace("\xa0", " ")
+    elif text[0] == "<":
+        replacement = " " if LINE_BREAK_RX.match(text) else ""
+    else:
+        # a non-breaking space
+        replacement = " "
+
+    if len(_html_replacements) < MAX_HTML_REPLACEMENTS:
+        _html_replacements[text] = replacement
+    return replacement
+
+
+def compare_keys(texts):
+    # the same as store.canonical. Phrases are compared as they're written, only
+    # anki fields have html to remove first
+    return [store.canonical(text) for text in texts]
+
+
+def get_existing_notes(notes, compare_field):
+    # the compare field of each note, without html
+    return normalise_fields(note["fields"][compare_field]["value"] for note in notes)
+
+
+def outline_length(strokes):
+    return (strokes.count("/"), len(strokes))
+
+
+def get_note_updates(notes, existing_notes, strokes_field, card_suggestions):
+    # [(note id, strokes field)] for notes where a shorter outline has been
+    # suggested since they were made, with it added before what's in the field.
+    # existing_notes is from get_existing_notes(notes, ...)
+    suggestions = card_suggestions.card_suggestions
+    notes = [
+        (note, key)
+        for (note, key) in zip(notes, compare_keys(existing_notes))
+        if strokes_field in note["fields"]
+    ]
+    strokes_values = normalise_fields(
+        note["fields"][strokes_field]["value"] for (note, _key) in notes
+    )
+
+    updates = []
+    for ((note, key), strokes_value) in zip(notes, strokes_values):
+        data = suggestions.get(key)
+        if data is None or len(data["strokes"]) == 0:
+            continue
+
+        shortest = min(data["strokes"], key=outline_length)
+        outlines = [
+            outline for outline in re.split(r"[\s,;]+", strokes_value) if outline
+        ]
+        # compared with the first outline, as the field may have notes after it
+        if (
+            outlines
+            and shortest not in outlines
+            and outline_length(shortest) < outline_length(outlines[0])
+        ):
+            # the field can have other outlines and notes, so they're kept
+            value = note["fields"][strokes_field]["value"]
+            updates.append((note["noteId"], f"{shortest}<br>{value}"))
 
-    return set(normalise_text(note["fields"][compare_field]["value"]) for note in notes)
+    return updates
 
 
 def get_ignored_from_file(ignore_file):
@@ -31,57 +179,78 @@ def get_ignored_from_file(ignore_file):
     return set(ignore_file.read_text().splitlines())
 
 
-def get_new_notes(new_notes_file):
-    if not new_notes_file.exists():
-        return {}
+class Card:
+    # a row in Cards, which keeps each field in its own column
+    __slots__ = ("cards", "row")
 
-    lines = new_notes_file.read_text().splitlines()
-    reader = csv.reader(lines)
-    result = {}
-    for line in reader:
-        if len(line) == 2:
-            result[line[0]] = line[1]
+    def __init__(self, cards, row):
+        self.cards = cards
+        self.row = row
 
-    return result
+    @property
+    def translation(self):
+        return self.cards.translation(self.row)
 
+    @property
+    def stroke_suggestions(self):
+        return self.cards.stroke_fields(self.row)[::2]
 
-@dataclass
-class Card:
-    translation: str
-    stroke_suggestions: List[str]
-    frequency: int
-    frequency_shorter: int
-    last_updated: int
-    chosen_strokes: str = None
-    ignored: bool = False
-    similar_ignored: List[str] = field(default_factory=list)
+    @property
+    def stroke_counts(self):
+        return [int(count) for count in self.cards.stroke_fields(self.row)[1::2]]
 
-    def choose_strokes(self, strokes):
-        self.ignored = False
-        self.chosen_strokes = strokes
+    @property
+    def frequency(self):
+        return self.cards.frequency[self.row]
 
-    def ignore(self):
-        self.ignored = True
-        self.chosen_strokes = None
+    @property
+    def frequency_shorter(self):
+        return self.cards.frequency_shorter[self.row]
 
-    def as_note(self):
-        def escape(text):
-            result = text.replace('"', '""')
-            return f'"{result}"'
+    @property
+    def recent_frequency(self):
+        return self.cards.recent_frequency[self.row]
 
-        return f"{escape(self.translation)},{escape(self.chosen_strokes)}"
+    @property
+    def last_updated(self):
+        return self.cards.last_updated[self.row] or None
 
+    @property
+    def chosen_strokes(self):
+        i = self.cards.chosen[self.row]
+        return None if i == NO_STROKES else self.cards.strings[i]
 
-def strokes_sort_key(strokes):
-    num_strokes = strokes.count("/")
-    return f"{num_strokes}{len(strokes)}{strokes}"
+    @property
+    def ignored(self):
+        return bool(self.cards.is_ignored[self.row])
 
+    @property
+    def similar_ignored(self):
+        return list(self.cards.similar_ignored.get(self.row, ()))
 
-def similar_words(word):
-    # does the reverse of tucked in suffix keys
-    # https://github.com/openstenoproject/plover/blob/91a84e16403e9d7470d0192c3b5484e422060a0b/plover/system/english_stenotype.py#L32
+    @property
+    def priority(self):
+        return self.cards.priority[self.row]
 
-    replacements = [
+    def choose_strokes(self, strokes):
+        self.cards.is_ignored[self.row] = False
+        self.cards.chosen[self.row] = (
+            NO_STROKES if strokes is None else self.cards.intern(strokes)
+        )
+
+    def ignore(self):
+        self.cards.is_ignored[self.row] = True
+        self.cards.chosen[self.row] = NO_STROKES
+
+    def as_note(self):
+        return (self.translation, self.chosen_strokes)
+
+
+# does the reverse of tucked in suffix keys
+# https://github.com/openstenoproject/plover/blob/91a84e16403e9d7470d0192c3b5484e422060a0b/plover/system/english_stenotype.py#L32
+SIMILAR_WORD_REPLACEMENTS = [
+    (re.compile(pattern), replacement)
+    for (pattern, replacement) in [
         ("s$", ""),
         ("es$", ""),
         ("ies$", "y"),
@@ -94,10 +263,13 @@ def similar_words(word):
         ("ied$", "y"),
         ("eed$", "ee"),
     ]
+]
+
 
+def similar_words(word):
     words = set()
-    for replacement in replacements:
-        (similar_word, count) = re.subn(replacement[0], replacement[1], word)
+    for (pattern, replacement) in SIMILAR_WORD_REPLACEMENTS:
+        (similar_word, count) = pattern.subn(replacement, word)
         if count > 0:
             words.add(similar_word)
 
@@ -106,132 +278,611 @@ def similar_words(word):
     return words
 
 
-def create_cards(card_suggestions, ignored, new_notes):
-    suggestions = card_suggestions.card_suggestions
+def card_records(items, ignored_keys, ignored, new_notes, day):
+    # ([card fields], [phrases to delete]), as tuples so they're quick to send
+    # between processes
+    records = []
+    ignored_phrases = []
+    for (phrase, data) in items:
+        # store keys are already compare keys
+        if phrase in ignored_keys:
+            ignored_phrases.append(phrase)
+            continue
+
+        translation = store.display(phrase, data)
+        records.append(
+            (
+                translation,
+                list(data["strokes"]),
+                list(data["strokes"].values()),
+                data["frequency"],
+                data.get("frequency_shorter", 0),
+                store.recent_frequency(data, RECENT_DAYS, day),
+                data.get("last_updated"),
+                new_notes.get(phrase, None),
+                list(similar_words(translation).intersection(ignored))
+                if ignored
+                else [],
+            )
+        )
 
-    cards = []
-    num_ignored = 0
-    for phrase, data in suggestions.copy().items():
-        if phrase in ignored:
-            num_ignored += 1
-            card_suggestions.delete(phrase)
+    return (records, ignored_phrases)
+
+
+@contextmanager
+def without_gc():
+    # making this many objects sets off the garbage collector over and over,
+    # and cards don't have reference cycles for it to find
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _init_worker(args_path):
+    _worker["args_path"] = args_path
+
+
+def _build_rows(rows):
+    # opened here rather than in _init_worker, so an error opening it comes back
+    # as the chunk's error rather than the process failing to start
+    if "snapshot" not in _worker:
+        with open(_worker["args_path"], "rb") as f:
+            (handle, *args) = pickle.load(f)
+        _worker["snapshot"] = Snapshot.from_handle(handle)
+        _worker["args"] = args
+
+    (start, stop) = rows
+    with without_gc():
+        return card_records(_worker["snapshot"].rows(start, stop), *_worker["args"])
+
+
+def parallel_records(snapshot, *args):
+    # each process opens the snapshot itself and builds the cards for a range of
+    # rows, which come back in order. Processes are spawned rather than forked,
+    # since plover has other threads running. Unlike multiprocessing.Pool, which
+    # starts new processes forever if they exit, the executor raises
+    # BrokenProcessPool
+    chunks = [
+        (start, min(start + PARALLEL_CHUNK_ROWS, snapshot.count))
+        for start in range(0, snapshot.count, PARALLEL_CHUNK_ROWS)
+    ]
+    processes = min(os.cpu_count() or 1, len(chunks))
+    with tempfile.TemporaryDirectory() as directory:
+        # the arguments are big (e.g. every ignored phrase), and a process which
+        # exits before reading more than a pipe holds of what it's started with
+        # would leave this waiting forever, so they're read from a file
+        args_path = Path(directory, "args.pickle")
+        with args_path.open("wb") as f:
+            pickle.dump((snapshot.handle(), *args), f, pickle.HIGHEST_PROTOCOL)
+
+        with ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(os.fspath(args_path),),
+        ) as executor:
+            yield from executor.map(_build_rows, chunks)
+
+
+def use_processes(card_suggestions):
+    return (
+        PARALLEL_BUILD
+        and isinstance(card_suggestions, Snapshot)
+        and card_suggestions.count >= PARALLEL_MIN_ROWS
+        and (os.cpu_count() or 1) > 1
+        # can't start another python from a frozen plover
+        and not getattr(sys, "frozen", False)
+        and _process_failures["count"] < MAX_PROCESS_FAILURES
+    )
+
+
+def collect(results):
+    records = []
+    ignored_phrases = []
+    for (chunk_records, chunk_ignored) in results:
+        records.extend(chunk_records)
+        ignored_phrases.extend(chunk_ignored)
+
+    return (records, ignored_phrases)
+
+
+def create_cards(card_suggestions, ignored, new_notes, phrases=None):
+    # returns the records for Cards.append, and the phrases which were ignored
+    ignored_keys = set(compare_keys(ignored))
+    new_notes = dict(zip(compare_keys(new_notes), new_notes.values()))
+    args = (ignored_keys, ignored, new_notes, store.today())
+
+    collected = None
+    if phrases is None and use_processes(card_suggestions):
+        try:
+            with without_gc():
+                collected = collect(parallel_records(card_suggestions, *args))
+        except Exception:  # pylint: disable=broad-except
+            # e.g. the processes couldn't start (BrokenProcessPool) or the
+            # snapshot was replaced while the cards were being built, build them
+            # here instead
+            log.error("plover_cards: failed to build cards in processes", exc_info=True)
+            _process_failures["count"] += 1
+            collected = None
+
+    if collected is None:
+        if phrases is None:
+            items = card_suggestions.items()
         else:
-            card = Card(
-                translation=phrase,
-                stroke_suggestions=sorted(list(data["strokes"]), key=strokes_sort_key),
-                frequency=data["frequency"],
-                frequency_shorter=data.get("frequency_shorter", 0),
-                last_updated=data.get("last_updated"),
-                chosen_strokes=new_notes.get(phrase, None),
-                similar_ignored=list(similar_words(phrase).intersection(ignored)),
-            )
-            cards.append(card)
+            suggestions = card_suggestions.card_suggestions
+            items = ((phrase, suggestions[phrase]) for phrase in phrases)
+        with without_gc():
+            collected = collect([card_records(items, *args)])
 
-    return (cards, num_ignored)
+    (records, ignored_phrases) = collected
+    for phrase in ignored_phrases:
+        card_suggestions.delete(phrase)
+
+    return (records, ignored_phrases)
 
 
 class Cards:
-    def __init__(self, config, card_suggestions):
+    def __init__(self, config, card_suggestions, session=None):
         self.config = config
+        self.session = session
+
+        self.ignored = set()
+        self.new_ignored = set()
+        self.num_saved = 0
+        self.num_added = 0
+        self.num_queued = 0
+        self.num_updated = 0
+        self.num_updates_queued = 0
+        # the errors from anki for notes which couldn't be updated
+        self.update_errors = []
+        self.note_updates = []
+        # suggested phrases without cards because they're ignored
+        self.ignored_phrases = set()
+        # what's been ignored, from the ignore file and anki, when the cards
+        # were built
+        self.all_ignored = set()
+
+        # each card is a row in these columns. A row's translation (utf-8) and
+        # strokes are the bytes from its offset to the next row's, as a str for
+        # each would take up more memory than the rest of the row
+        self.translations = bytearray()
+        self.translation_offsets = array("I", [0])
+        self.strokes = bytearray()
+        self.stroke_offsets = array("I", [0])
+        self.frequency = array("I")
+        self.frequency_shorter = array("I")
+        self.recent_frequency = array("I")
+        self.last_updated = array("d")
+        self.priority = array("d")
+        self.chosen = array("I")
+        self.is_ignored = bytearray()
+        # row: similar ignored words, for the few rows which have any
+        self.similar_ignored = {}
+        # chosen strokes, which are ids in this
+        self.strings = []
+        self.string_ids = {}
+        # the rows in the order they're shown, so sorting doesn't move the
+        # columns around
+        self.order = array("I")
+
+        state = None
+        if self.session is not None:
+            state = self.session.load(config)
+
+        if state is None:
+            built_at = time.time()
+            self._build(card_suggestions)
+            if self.session is not None:
+                self.session.start(config, self, built_at)
+        else:
+            self._resume(card_suggestions, state)
+
+    @property
+    def num_ignored(self):
+        return len(self.ignored_phrases)
+
+    @property
+    def num_rows(self):
+        return len(self.frequency)
+
+    def columns(self):
+        return {name: getattr(self, name) for name in CARD_COLUMNS}
+
+    def load_columns(self, columns):
+        for name in CARD_COLUMNS:
+            setattr(self, name, columns[name])
+        self.string_ids = {text: i for i, text in enumerate(self.strings)}
+
+    def intern(self, text):
+        i = self.string_ids.get(text)
+        if i is None:
+            i = len(self.strings)
+            self.strings.append(text)
+            self.string_ids[text] = i
+
+        return i
+
+    def translation(self, row):
+        (start, stop) = self.translation_offsets[row : row + 2]
+        return self.translations[start:stop].decode("utf-8")
+
+    def stroke_fields(self, row):
+        # [stroke, count, stroke, count...]
+        (start, stop) = self.stroke_offsets[row : row + 2]
+        if start == stop:
+            return []
+        return self.strokes[start:stop].decode("utf-8").split(STROKES_SEPARATOR)
+
+    def _add_rows(self, records):
+        # returns the first new row
+        start = self.num_rows
+        with without_gc():
+            for (
+                row,
+                (
+                    translation,
+                    stroke_suggestions,
+                    stroke_counts,
+                    frequency,
+                    frequency_shorter,
+                    recent_frequency,
+                    last_updated,
+                    chosen_strokes,
+                    similar_ignored,
+                ),
+            ) in enumerate(records, start):
+                self.translations += translation.encode("utf-8")
+                self.translation_offsets.append(len(self.translations))
+                self.strokes += STROKES_SEPARATOR.join(
+                    f"{stroke}{STROKES_SEPARATOR}{count}"
+                    for (stroke, count) in zip(stroke_suggestions, stroke_counts)
+                ).encode("utf-8")
+                self.stroke_offsets.append(len(self.strokes))
+                self.frequency.append(frequency)
+                self.frequency_shorter.append(frequency_shorter)
+                self.recent_frequency.append(recent_frequency)
+                self.last_updated.append(last_updated or 0)
+                self.chosen.append(
+                    NO_STROKES
+                    if chosen_strokes is None
+                    else self.intern(chosen_strokes)
+                )
+                if similar_ignored:
+                    self.similar_ignored[row] = similar_ignored
+
+        num_rows = self.num_rows - start
+        self.is_ignored.extend(bytes(num_rows))
+        self.priority.extend(array("d", bytes(8 * num_rows)))
+        self.score(start)
 
-        ignored = set()
-        if self.config.getboolean("compare_ignore", "enabled"):
+        return start
+
+    def _build(self, card_suggestions):
+        if self.config.compare_ignore.enabled:
             self.ignored = get_ignored_from_file(
-                Path(self.config["compare_ignore"]["file_path"])
+                Path(self.config.compare_ignore.file_path)
             )
-            ignored.update(self.ignored)
-        if self.config.getboolean("compare_to_anki", "enabled"):
-            ignored.update(
-                get_existing_notes(
-                    self.config["compare_to_anki"]["query"],
-                    self.config["compare_to_anki"]["compare_field"],
-                )
+            self.all_ignored.update(self.ignored)
+        if self.config.compare_to_anki.enabled:
+            anki_settings = self.config.compare_to_anki
+            anki_notes = anki_utils.get_notes(anki_settings.query)
+            existing_notes = get_existing_notes(
+                anki_notes, anki_settings.compare_field
             )
+            self.all_ignored.update(existing_notes)
+            if anki_settings.update_strokes:
+                # before create_cards deletes the existing notes' suggestions
+                self.note_updates = get_note_updates(
+                    anki_notes,
+                    existing_notes,
+                    anki_settings.strokes_field,
+                    card_suggestions,
+                )
 
         new_notes = {}
-        if self.config.getboolean("output_csv", "enabled"):
-            new_notes = get_new_notes(Path(self.config["output_csv"]["file_path"]))
+        if self.config.output_csv.enabled:
+            new_notes = OutputCsv(self.config.output_csv.file_path).notes
 
-        (self.cards, self.num_ignored) = create_cards(
+        (records, ignored_phrases) = create_cards(
             card_suggestions,
-            ignored,
+            self.all_ignored,
             new_notes,
         )
-
-        self.new_ignored = set()
-        self.num_saved = 0
-        self.num_added = 0
+        self.ignored_phrases = set(ignored_phrases)
+        self.append(records)
+
+    def _resume(self, card_suggestions, state):
+        self.load_columns(state["cards"])
+        # scores go down over time
+        self.score()
+        self.all_ignored = state["all_ignored"]
+        self.ignored_phrases = state["ignored_phrases"]
+        self.note_updates = state["note_updates"]
+
+        # removed because they were added to the ignore file
+        removed = set(compare_keys(state["removed"]))
+        self.ignored_phrases.update(removed)
+        self.order = array(
+            "I",
+            (
+                row
+                for row in self.order
+                if store.canonical(self.translation(row)) not in removed
+            ),
+        )
+        if self.config.compare_ignore.enabled:
+            # read again, as it's saved from this and can have been edited since
+            self.remove(self.reload_ignored(card_suggestions))
+
+        # only suggestions recorded since the session was started need new cards
+        changed = [
+            phrase
+            for phrase, data in card_suggestions.items()
+            if (data.get("last_updated") or 0) > state["built_at"]
+        ]
+        (_updated, new_records) = self.merge_changes(card_suggestions, changed)
+        self.append(new_records)
+
+        choices = {
+            store.canonical(translation): choice
+            for translation, choice in state["choices"].items()
+        }
+        for card in self:
+            choice = choices.get(store.canonical(card.translation))
+            if choice is None:
+                continue
+
+            (strokes, ignored) = choice
+            if ignored:
+                card.ignore()
+                self.new_ignored.add(card.translation)
+            else:
+                card.choose_strokes(strokes)
+
+    def merge_changes(self, card_suggestions, phrases):
+        # updates the cards for phrases which have changed, returns the indexes
+        # of the updated cards and the records of new cards, which still need
+        # appending
+        suggestions = card_suggestions.card_suggestions
+        # a reloaded store can still have phrases which were ignored, until the
+        # hook deletes them
+        phrases = [
+            phrase
+            for phrase in phrases
+            if phrase in suggestions and phrase not in self.ignored_phrases
+        ]
+        (records, ignored_phrases) = create_cards(
+            card_suggestions, self.all_ignored, {}, phrases
+        )
+        self.ignored_phrases.update(ignored_phrases)
+
+        card_indexes = {
+            store.canonical(self.translation(row)): i
+            for i, row in enumerate(self.order)
+        }
+        updated = []
+        new_records = []
+        for record in records:
+            i = card_indexes.get(store.canonical(record[0]))
+            if i is None:
+                new_records.append(record)
+            else:
+                updated.append((i, record))
+
+        # updated cards get new rows, which keep what was chosen for the old ones
+        start = self._add_rows([record for (_i, record) in updated])
+        for (row, (i, _record)) in enumerate(updated, start):
+            old_row = self.order[i]
+            self.chosen[row] = self.chosen[old_row]
+            self.is_ignored[row] = self.is_ignored[old_row]
+            self.order[i] = row
+        self._compact_if_needed()
+
+        return ([i for (i, _record) in updated], new_records)
+
+    def reload_ignored(self, card_suggestions):
+        # returns the indexes of cards which have been added to the ignore file
+        # since it was last read, which still need removing
+        ignored = get_ignored_from_file(Path(self.config.compare_ignore.file_path))
+        added = ignored - self.ignored
+        self.ignored = ignored
+        self.all_ignored.update(added)
+        if len(added) == 0:
+            return []
+
+        added_keys = set(compare_keys(added))
+        keys = compare_keys(self.translation(row) for row in self.order)
+        indexes = [i for i, key in enumerate(keys) if key in added_keys]
+        for i in indexes:
+            phrase = store.canonical(self.translation(self.order[i]))
+            self.ignored_phrases.add(phrase)
+            if phrase in card_suggestions.card_suggestions:
+                card_suggestions.delete(phrase)
+
+        return indexes
+
+    def append(self, records):
+        start = self._add_rows(records)
+        self.order.extend(range(start, self.num_rows))
+
+    def remove(self, indexes):
+        for i in sorted(indexes, reverse=True):
+            translation = self.translation(self.order[i])
+            self.new_ignored.discard(translation)
+            if self.session is not None:
+                self.session.record_remove(translation)
+            del self.order[i]
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        num_unused = self.num_rows - len(self.order)
+        if num_unused >= max(MIN_ROWS_TO_COMPACT, len(self.order)):
+            self._compact()
+
+    def _compact(self):
+        # copies the rows in order into new columns, without the unused ones
+        order = self.order
+        for (text_name, offsets_name) in (
+            ("translations", "translation_offsets"),
+            ("strokes", "stroke_offsets"),
+        ):
+            text = getattr(self, text_name)
+            offsets = getattr(self, offsets_name)
+            new_text = bytearray()
+            new_offsets = array("I", [0])
+            for row in order:
+                (start, stop) = offsets[row : row + 2]
+                new_text += text[start:stop]
+                new_offsets.append(len(new_text))
+            setattr(self, text_name, new_text)
+            setattr(self, offsets_name, new_offsets)
+
+        for name in (
+            "frequency",
+            "frequency_shorter",
+            "recent_frequency",
+            "last_updated",
+            "priority",
+            "chosen",
+        ):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, map(column.__getitem__, order)))
+        self.is_ignored = bytearray(map(self.is_ignored.__getitem__, order))
+        self.similar_ignored = {
+            new_row: self.similar_ignored[row]
+            for (new_row, row) in enumerate(order)
+            if row in self.similar_ignored
+        }
+
+        self.order = array("I", range(len(order)))
+
+    def index(self, translation):
+        phrase = store.canonical(translation)
+        for (i, row) in enumerate(self.order):
+            if store.canonical(self.translation(row)) == phrase:
+                return i
+        return None
 
     def __getitem__(self, index):
-        return self.cards[index]
+        return Card(self, self.order[index])
 
     def __len__(self):
-        return len(self.cards)
+        return len(self.order)
+
+    def __iter__(self):
+        for row in self.order:
+            yield Card(self, row)
 
     def choose_strokes(self, index, strokes):
-        card = self.cards[index]
+        card = self[index]
         card.choose_strokes(strokes)
         self.new_ignored.discard(card.translation)
+        if self.session is not None:
+            self.session.record_choice(card)
 
     def ignore(self, index):
-        card = self.cards[index]
+        card = self[index]
         card.ignore()
         self.new_ignored.add(card.translation)
+        if self.session is not None:
+            self.session.record_choice(card)
 
-    def save(self):
+    def save(self, on_progress=None):
         notes = []
 
-        if self.config.getboolean("output_csv", "enabled"):
-            output_path = Path(self.config["output_csv"]["file_path"])
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            notes = self._as_notes()
-            self.num_saved = len(notes)
-
-            mode = (
-                "w" if self.config["output_csv"]["write_method"] == "Overwrite" else "a"
-            )
-            with output_path.open(mode) as f:
-                f.write("\n".join(notes))
-                f.write("\n")
-
-        if self.config.getboolean("add_to_anki", "enabled"):
-            anki_settings = self.config["add_to_anki"]
-            added = anki_utils.invoke(
-                "addNotes",
-                notes=[
-                    {
-                        "deckName": anki_settings["deck"],
-                        "modelName": anki_settings["note_type"],
-                        "fields": {
-                            anki_settings["translation_field"]: card.translation,
-                            anki_settings["strokes_field"]: card.chosen_strokes,
-                        },
-                        "tags": anki_settings["tags"].split(" "),
-                        "options": {
-                            # Duplicates shouldn't be showing up, but in case they do,
-                            # I don't want this to blow up
-                            "allowDuplicate": True
-                        },
-                    }
-                    for card in self.cards
-                    if not card.ignored and card.chosen_strokes
-                ],
+        if self.config.output_csv.enabled:
+            output = OutputCsv(self.config.output_csv.file_path)
+            self.num_saved = output.write(
+                self._as_notes(),
+                append=self.config.output_csv.write_method == "Append",
             )
 
-            self.num_added = sum(1 for note in added if note != "null")
-
-        if self.config.getboolean("compare_ignore", "enabled"):
-            ignore_path = Path(self.config["compare_ignore"]["file_path"])
+        if self.config.add_to_anki.enabled:
+            anki_settings = self.config.add_to_anki
+            notes = [
+                {
+                    "deckName": anki_settings.deck,
+                    "modelName": anki_settings.note_type,
+                    "fields": {
+                        anki_settings.translation_field: card.translation,
+                        anki_settings.strokes_field: card.chosen_strokes,
+                    },
+                    "tags": anki_settings.tags.split(" "),
+                    "options": {
+                        # Duplicates shouldn't be showing up, but in case they do,
+                        # I don't want this to blow up
+                        "allowDuplicate": True
+                    },
+                }
+                for card in self
+                if not card.ignored and card.chosen_strokes
+            ]
+
+            try:
+                added = anki_utils.invoke("addNotes", notes=notes)
+                self.num_added = sum(1 for note in added if note != "null")
+            except OSError:
+                # anki isn't running, send them when it is
+                OUTBOX.enqueue("addNotes", notes=notes)
+                self.num_queued = len(notes)
+
+        if self.note_updates:
+            self._update_notes(on_progress)
+
+        if self.config.compare_ignore.enabled:
+            ignore_path = Path(self.config.compare_ignore.file_path)
             all_ignored = self.ignored.union(self.new_ignored)
             ignore_path.parent.mkdir(parents=True, exist_ok=True)
             ignore_path.write_text("\n".join(sorted(list(all_ignored))))
 
-    def sort(self, *args, **kwargs):
-        self.cards.sort(*args, **kwargs)
+    def _update_notes(self, on_progress=None):
+        strokes_field = self.config.compare_to_anki.strokes_field
+        actions = [
+            anki_utils.request(
+                "updateNoteFields",
+                note={"id": note_id, "fields": {strokes_field: strokes}},
+            )
+            for (note_id, strokes) in self.note_updates
+        ]
+
+        (num_sent, errors) = anki_utils.invoke_multi(actions, on_progress=on_progress)
+        self.num_updated = num_sent - len(errors)
+        self.update_errors = [error for (_i, error) in errors]
+        for action in actions[num_sent:]:
+            # anki isn't running, send them when it is
+            OUTBOX.enqueue(action["action"], **action["params"])
+            self.num_updates_queued += 1
+
+    def score(self, start=0):
+        # scores rows from start onwards
+        scores = scoring.priority_scores(
+            self.frequency[start:],
+            self.frequency_shorter[start:],
+            self.last_updated[start:],
+        )
+        self.priority[start:] = array("d", scores)
+
+    def sort(self, key, reverse=False):
+        # key is given a Card
+        self.order = array(
+            "I",
+            sorted(self.order, key=lambda row: key(Card(self, row)), reverse=reverse),
+        )
+
+    def sort_by(self, column, reverse=False):
+        # column is one of the columns above, indexed by row
+        values = [column[row] for row in self.order]
+        self.order = array(
+            "I", [self.order[i] for i in scoring.argsort(values, reverse)]
+        )
 
     def _as_notes(self):
         return [
             card.as_note()
-            for card in self.cards
+            for card in self
             if not card.ignored and card.chosen_strokes
         ]
@@ -0,0 +1,199 @@
+import csv
+import locale
+import os
+from pathlib import Path
+import pickle
+
+from plover.oslayer.config import CONFIG_DIR as PLOVER_CONFIG_DIR
+
+VERSION = 2
+# when appending, the file is rewritten without replaced rows once it has this
+# many rows per note
+MAX_ROWS_PER_NOTE = 2
+# but small files are left alone
+MIN_ROWS_TO_COMPACT = 1000
+# bytes at the end of the file kept in the index, to tell if it's only been
+# appended to since
+TAIL_SIZE = 64
+
+
+class OutputCsv:
+    # The notes in the output csv are kept in INDEX_PATH along with the size of
+    # the file, so the csv is only read again from where it was changed
+    INDEX_PATH = Path(PLOVER_CONFIG_DIR, "plover_cards", "output_csv_index.pickle")
+
+    def __init__(self, path):
+        self.path = Path(path)
+        # translation -> strokes, the last row for each translation
+        self.notes = {}
+        # rows which aren't notes, which are kept when the file is rewritten
+        self.other_rows = []
+        self.num_rows = 0
+        self.size = 0
+        # older versions wrote in the locale's encoding, which is kept
+        self.encoding = "utf-8"
+        self._load()
+
+    def write(self, rows, append=True):
+        # returns the number of rows written
+        rows = dict(rows)
+        if not append or not self.path.exists():
+            self.other_rows = []
+            self._rewrite(rows)
+            return len(rows)
+
+        # already in the file
+        rows = {
+            translation: strokes
+            for translation, strokes in rows.items()
+            if self.notes.get(translation) != strokes
+        }
+        num_notes = len(set(self.notes).union(rows))
+        if not self._can_encode(rows) or self.num_rows + len(rows) > max(
+            MIN_ROWS_TO_COMPACT, MAX_ROWS_PER_NOTE * num_notes
+        ):
+            notes = dict(self.notes)
+            notes.update(rows)
+            self._rewrite(notes)
+            return len(rows)
+
+        with self.path.open("a", newline="", encoding=self.encoding) as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+            writer.writerows(rows.items())
+        self.notes.update(rows)
+        self.num_rows += len(rows)
+        self._save_index()
+
+        return len(rows)
+
+    def _can_encode(self, notes):
+        try:
+            for (translation, strokes) in notes.items():
+                translation.encode(self.encoding)
+                strokes.encode(self.encoding)
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    def _rewrite(self, notes):
+        if not self._can_encode(notes):
+            # utf-8 can write anything the old encoding could
+            self.encoding = "utf-8"
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w", newline="", encoding=self.encoding) as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+            writer.writerows(self.other_rows)
+            writer.writerows(notes.items())
+        tmp_path.replace(self.path)
+
+        self.notes = dict(notes)
+        self.num_rows = len(self.other_rows) + len(notes)
+        self._save_index()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+
+        index = self._read_index()
+        if index is not None:
+            self.notes = index["notes"]
+            self.other_rows = index["other_rows"]
+            self.num_rows = index["rows"]
+            self.size = index["size"]
+            self.encoding = index["encoding"]
+
+        stat = self.path.stat()
+        if (
+            index is not None
+            and stat.st_mtime_ns == index["mtime_ns"]
+            and stat.st_size == index["size"]
+        ):
+            return
+
+        if index is None or self._tail(self.size) != index["tail"]:
+            # changed by something else, read all of it again
+            self._clear()
+
+        try:
+            rows = self._read_from(self.size, self.encoding)
+        except UnicodeDecodeError:
+            # written by an older version, or something else, in the locale's
+            # encoding. latin-1 reads any bytes, so rewriting keeps them as
+            # they were
+            self._clear()
+            for encoding in (locale.getpreferredencoding(False), "latin-1"):
+                try:
+                    rows = self._read_from(0, encoding)
+                except UnicodeDecodeError:
+                    continue
+                self.encoding = encoding
+                break
+
+        for row in rows:
+            self.num_rows += 1
+            if len(row) == 2:
+                self.notes[row[0]] = row[1]
+            else:
+                self.other_rows.append(row)
+        self._save_index()
+
+    def _clear(self):
+        self.notes = {}
+        self.other_rows = []
+        self.num_rows = 0
+        self.size = 0
+
+    def _read_from(self, offset, encoding):
+        with self.path.open(newline="", encoding=encoding) as f:
+            f.seek(offset)
+            return [row for row in csv.reader(f) if len(row) > 0]
+
+    def _tail(self, size):
+        if size == 0:
+            return ""
+
+        with self.path.open("rb") as f:
+            f.seek(max(size - TAIL_SIZE, 0))
+            return f.read(min(size, TAIL_SIZE)).decode("latin-1")
+
+    def _read_index(self):
+        if not self.INDEX_PATH.exists():
+            return None
+
+        try:
+            with self.INDEX_PATH.open("rb") as f:
+                index = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        if index.get("version") != VERSION or index.get("path") != os.fspath(
+            self.path.resolve()
+        ):
+            return None
+        if self.path.stat().st_size < index["size"]:
+            return None
+
+        return index
+
+    def _save_index(self):
+        stat = self.path.stat()
+        self.size = stat.st_size
+        index = {
+            "version": VERSION,
+            "path": os.fspath(self.path.resolve()),
+            "size": self.size,
+            "mtime_ns": stat.st_mtime_ns,
+            "tail": self._tail(self.size),
+            "rows": self.num_rows,
+            "notes": self.notes,
+            "other_rows": self.other_rows,
+            "encoding": self.encoding,
+        }
+
+        self.INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.INDEX_PATH.with_suffix(".tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(index, f)
+        tmp_path.replace(self.INDEX_PATH)
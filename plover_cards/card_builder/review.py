@@ -0,0 +1,79 @@
+from collections import OrderedDict
+
+from PyQt5 import QtCore
+from PyQt5 import QtGui
+
+# how many cards either side of the current one to get ready
+PREFETCH = 5
+
+
+class ReviewEngine(QtCore.QObject):
+    # builds the stroke suggestion models for the cards around the current one
+    # while the ui is idle, so going to the next/previous card only has to swap
+    # models
+    def __init__(self, cards, parent=None):
+        super().__init__(parent)
+        self.cards = cards
+
+        # translation -> (model, {strokes: row})
+        self.models = OrderedDict()
+        self.spare_models = []
+        self.queue = []
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self._prefetch_one)
+
+    def model(self, card):
+        if card.translation not in self.models:
+            self.models[card.translation] = self._build(card)
+
+        return self.models[card.translation]
+
+    def forget(self, translation):
+        # the card has changed, so its model needs building again
+        if translation in self.models:
+            (model, _rows) = self.models.pop(translation)
+            self.spare_models.append(model)
+
+    def prefetch(self, card_index):
+        window = [card_index]
+        for offset in range(1, PREFETCH + 1):
+            window.extend([card_index + offset, card_index - offset])
+        window = [i for i in window if 0 <= i < len(self.cards)]
+        keep = set(self.cards[i].translation for i in window)
+
+        for translation in list(self.models):
+            if translation not in keep:
+                (model, _rows) = self.models.pop(translation)
+                self.spare_models.append(model)
+
+        self.queue = [i for i in window if self.cards[i].translation not in self.models]
+        if self.queue:
+            self.timer.start()
+
+    def _prefetch_one(self):
+        if not self.queue:
+            return
+
+        self.model(self.cards[self.queue.pop(0)])
+        if self.queue:
+            self.timer.start()
+
+    def _build(self, card):
+        if self.spare_models:
+            model = self.spare_models.pop()
+            model.clear()
+        else:
+            model = QtGui.QStandardItemModel(self)
+
+        rows = {}
+        for suggestion, count in zip(card.stroke_suggestions, card.stroke_counts):
+            item = QtGui.QStandardItem(suggestion)
+            item.setToolTip(f"Suggested {count} time(s)")
+            item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
+            rows[suggestion] = model.rowCount()
+            model.appendRow(item)
+
+        return (model, rows)
@@ -0,0 +1,53 @@
+from array import array
+import time
+
+# a suggestion's score halves for every week it isn't used
+HALF_LIFE = 7 * 24 * 60 * 60
+
+
+def _numpy():
+    # numpy is optional and slow to import, so only import it when scoring
+    try:
+        import numpy  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+
+    return numpy
+
+
+def priority_scores(frequency, frequency_shorter, last_updated, now=None):
+    # frequency x recency decay x (1 + how often there was a shorter stroke)
+    if now is None:
+        now = time.time()
+
+    numpy = _numpy()
+    if numpy is not None:
+        frequency = numpy.asarray(frequency, dtype=float)
+        age = numpy.maximum(now - numpy.asarray(last_updated, dtype=float), 0)
+        shorter_ratio = numpy.divide(
+            frequency_shorter,
+            frequency,
+            out=numpy.zeros_like(frequency),
+            where=frequency > 0,
+        )
+        return frequency * numpy.exp2(-age / HALF_LIFE) * (1 + shorter_ratio)
+
+    return array(
+        "d",
+        (
+            f * 2 ** (-max(now - t, 0) / HALF_LIFE) * (1 + (s / f if f > 0 else 0))
+            for f, s, t in zip(frequency, frequency_shorter, last_updated)
+        ),
+    )
+
+
+def argsort(scores, reverse=False):
+    numpy = _numpy()
+    if numpy is not None:
+        if not reverse:
+            return numpy.argsort(scores, kind="stable").tolist()
+        # like sorted(reverse=True), ties stay in the order they were in
+        order = numpy.argsort(numpy.asarray(scores)[::-1], kind="stable")
+        return (len(scores) - 1 - order[::-1]).tolist()
+
+    return sorted(range(len(scores)), key=scores.__getitem__, reverse=reverse)
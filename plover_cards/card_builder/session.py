@@ -0,0 +1,126 @@
+import json
+from pathlib import Path
+import pickle
+
+from plover.oslayer.config import CONFIG_DIR as PLOVER_CONFIG_DIR
+
+VERSION = 7
+
+
+class ReviewSession:
+    # The cards as they were first built are saved once in PATH, and every
+    # choice after that is appended to JOURNAL_PATH, so closing the card builder
+    # doesn't lose anything and reopening it doesn't need to rebuild every card
+    PATH = Path(PLOVER_CONFIG_DIR, "plover_cards", "review_session.pickle")
+    JOURNAL_PATH = Path(PLOVER_CONFIG_DIR, "plover_cards", "review_session.jsonl")
+
+    def __init__(self, profile_keys=()):
+        # the profiles the suggestions were read from. The suggestions setting
+        # can be "current", which is a different profile after plover's system
+        # or dictionaries change
+        self.profile_keys = tuple(profile_keys)
+        self.resumed = False
+        # the translation of the card being reviewed, as cards can be added or
+        # sorted before the session is resumed
+        self.current = None
+        self.sort = None
+
+    def load(self, config):
+        if not self.PATH.exists():
+            return None
+
+        try:
+            with self.PATH.open("rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        if state.get("version") != VERSION or state["settings"] != settings_key(
+            config, self.profile_keys
+        ):
+            # built with different suggestions/compare/output settings, so start
+            # again
+            return None
+
+        state["choices"] = {}
+        state["removed"] = []
+        if self.JOURNAL_PATH.exists():
+            with self.JOURNAL_PATH.open() as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line may be cut off if plover was killed
+                        continue
+
+                    if "choose" in entry:
+                        state["choices"][entry["choose"]] = (entry["strokes"], False)
+                    elif "ignore" in entry:
+                        state["choices"][entry["ignore"]] = (None, True)
+                    elif "remove" in entry:
+                        state["removed"].append(entry["remove"])
+                    elif "current" in entry:
+                        self.current = entry["current"]
+                    elif "sort" in entry:
+                        self.sort = tuple(entry["sort"])
+
+        self.resumed = True
+        return state
+
+    def start(self, config, cards, built_at):
+        self.PATH.parent.mkdir(parents=True, exist_ok=True)
+        with self.PATH.open("wb") as f:
+            pickle.dump(
+                {
+                    "version": VERSION,
+                    "settings": settings_key(config, self.profile_keys),
+                    "built_at": built_at,
+                    "cards": cards.columns(),
+                    "all_ignored": cards.all_ignored,
+                    "ignored_phrases": cards.ignored_phrases,
+                    "note_updates": cards.note_updates,
+                },
+                f,
+            )
+        self.JOURNAL_PATH.write_text("")
+
+    def record_choice(self, card):
+        if card.ignored:
+            self._append({"ignore": card.translation})
+        else:
+            self._append({"choose": card.translation, "strokes": card.chosen_strokes})
+
+    def record_remove(self, translation):
+        self._append({"remove": translation})
+
+    def record_current(self, translation):
+        if translation != self.current:
+            self.current = translation
+            self._append({"current": translation})
+
+    def record_sort(self, column, order):
+        if (column, order) != self.sort:
+            self.sort = (column, order)
+            self._append({"sort": [column, order]})
+
+    def clear(self):
+        for path in (self.PATH, self.JOURNAL_PATH):
+            if path.exists():
+                path.unlink()
+
+    def _append(self, entry):
+        if not self.PATH.exists():
+            return
+
+        with self.JOURNAL_PATH.open("a") as f:
+            f.write(json.dumps(entry))
+            f.write("\n")
+
+
+def settings_key(config, profile_keys):
+    return (
+        profile_keys,
+        config.compare_ignore,
+        config.compare_to_anki,
+        config.output_csv,
+    )
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from PyQt5 import QtWidgets
 
 
@@ -53,3 +55,10 @@ def combobox_set_items(combobox, new_items, default):
     index = combobox.findText(default)
     if index > -1:
         combobox.setCurrentIndex(index)
+
+
+def mtime(path):
+    try:
+        return Path(path).stat().st_mtime
+    except OSError:
+        return None
@@ -1,9 +1,98 @@
+import socket
+from threading import Condition, Thread
+
+from plover import log
 from plover.formatting import RetroFormatter
 
 from plover_cards import anki_utils
 from plover_cards import config
+from plover_cards.anki_outbox import OUTBOX
+
+# seconds to wait for anki to open the add cards window
+TIMEOUT = 10
+
+
+class AddCardWorker:
+    # adds cards away from plover's command thread so strokes aren't held up
+    # waiting for anki. Cards asked for before anki answers are added in order,
+    # and asking for the same text again before it's added only adds it once
+    def __init__(self):
+        self.condition = Condition()
+        # text: engine
+        self.pending = {}
+        self.thread = None
+
+    def add(self, engine, text):
+        with self.condition:
+            self.pending[text] = engine
+            self.condition.notify()
+
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0:
+                    self.condition.wait()
+                text = next(iter(self.pending))
+                engine = self.pending.pop(text)
+
+            try:
+                self._add_card(engine, text)
+            except Exception:  # pylint: disable=broad-except
+                log.error("plover_cards: failed to add card", exc_info=True)
+
+    def _add_card(self, engine, text):
+        with engine:
+            suggestions = engine.get_suggestions(text)
+        strokes = "<br>\n".join(
+            "<br>\n".join("/".join(s) for s in suggestion.steno_list)
+            for suggestion in suggestions
+        )
+
+        try:
+            config.CONFIG.migrate_anki()
+        except OSError:
+            # the deck and note type are still in the old [anki] section
+            log.warning("plover_cards: can't add card until anki is running")
+            return
+        anki_settings = config.CONFIG.get().add_to_anki
+        note = {
+            "deckName": anki_settings.deck,
+            "modelName": anki_settings.note_type,
+            "fields": {
+                anki_settings.translation_field: text,
+                anki_settings.strokes_field: strokes,
+            },
+            "options": {
+                "closeAfterAdding": True,
+            },
+            "tags": anki_settings.tags,
+        }
 
-CONFIG = config.read()
+        try:
+            anki_utils.invoke("guiAddCards", timeout=TIMEOUT, note=note)
+        except socket.timeout:
+            # anki got the request but didn't answer in time. It may still open
+            # the window, so don't try again
+            log.warning("plover_cards: timed out waiting for anki to add card")
+        except OSError as e:
+            # urllib raises errors from connecting as URLError, including timing
+            # out while connecting (before and after python 3.10 made
+            # socket.timeout TimeoutError). Anki never got the request then, so
+            # like when anki isn't running, open it when anki answers
+            if isinstance(getattr(e, "reason", None), socket.timeout):
+                log.warning("plover_cards: timed out connecting to anki")
+            # there's only one add cards window, so each queued card would
+            # replace the last one in it. They're added without it instead
+            queued_note = dict(note, tags=anki_settings.tags.split())
+            del queued_note["options"]
+            OUTBOX.enqueue("addNotes", notes=[queued_note])
+
+
+WORKER = AddCardWorker()
 
 
 def add_card(engine, args):
@@ -16,23 +105,5 @@ def add_card(engine, args):
         last_translations = engine.translator_state.translations
         retro_formatter = RetroFormatter(last_translations)
         text = " ".join(retro_formatter.last_words(count=num_words, strip=True))
-        strokes = "<br>\n".join(
-            "<br>\n".join("/".join(s) for s in suggestion.steno_list)
-            for suggestion in engine.get_suggestions(text)
-        )
 
-    anki_utils.invoke(
-        "guiAddCards",
-        note={
-            "deckName": CONFIG.get("add_to_anki", "deck"),
-            "modelName": CONFIG.get("add_to_anki", "note_type"),
-            "fields": {
-                CONFIG.get("add_to_anki", "translation_field"): text,
-                CONFIG.get("add_to_anki", "strokes_field"): strokes,
-            },
-            "options": {
-                "closeAfterAdding": True,
-            },
-            "tags": CONFIG.get("add_to_anki", "tags"),
-        },
-    )
+    WORKER.add(engine, text)
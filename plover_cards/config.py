@@ -1,12 +1,73 @@
 import configparser
+from dataclasses import dataclass, fields
+import io
 from pathlib import Path
+from threading import RLock
 
+from plover import log
 from plover.oslayer.config import CONFIG_DIR as PLOVER_CONFIG_DIR
-from plover_cards import anki_utils
 
 CONFIG_PATH = Path(PLOVER_CONFIG_DIR, "plover_cards.cfg")
 
 
+@dataclass(frozen=True)
+class Suggestions:
+    profile: str
+
+
+@dataclass(frozen=True)
+class CompareIgnore:
+    enabled: bool
+    file_path: str
+
+
+@dataclass(frozen=True)
+class CompareToAnki:
+    enabled: bool
+    query: str
+    compare_field: str
+    update_strokes: bool
+    strokes_field: str
+
+
+@dataclass(frozen=True)
+class OutputCsv:
+    enabled: bool
+    file_path: str
+    write_method: str
+
+
+@dataclass(frozen=True)
+class AddToAnki:
+    enabled: bool
+    deck: str
+    note_type: str
+    translation_field: str
+    strokes_field: str
+    tags: str
+
+
+@dataclass(frozen=True)
+class Hook:
+    max_phrase_parts: int
+    max_translations: int
+    misstroke_offset: int
+    sample_every: int
+    high_wpm: int
+    high_wpm_max_phrase_parts: int
+    commit_delay: int
+
+
+@dataclass(frozen=True)
+class Settings:
+    suggestions: Suggestions
+    compare_ignore: CompareIgnore
+    compare_to_anki: CompareToAnki
+    output_csv: OutputCsv
+    add_to_anki: AddToAnki
+    hook: Hook
+
+
 def migrate(config):
     if config.has_section("paths"):
         if config.has_option("paths", "anki_collection"):
@@ -25,29 +86,6 @@ def migrate(config):
 
         del config["paths"]
 
-    if config.has_section("anki"):
-        note_type = ""
-
-        if config.has_option("anki", "card_type"):
-            note_type = config["anki"]["card_type"]
-            del config["anki"]["card_type"]
-
-        if config.has_option("anki", "note_type"):
-            note_type = config["anki"]["note_type"]
-            del config["anki"]["note_type"]
-
-        if note_type in anki_utils.invoke("modelNames"):
-            config["compare_to_anki"]["enabled"] = "yes"
-            config["compare_to_anki"]["query"] = f"note:{note_type}"
-            config["compare_to_anki"]["compare_field"] = anki_utils.invoke(
-                "modelFieldNames", modelName=note_type
-            )[0]
-
-            config["add_to_anki"]["enabled"] = "yes"
-            config["add_to_anki"]["note_type"] = note_type
-
-        del config["anki"]
-
     if config.has_section("options"):
         if config.has_option("options", "clear_output_on_start"):
             if config["options"]["clear_output_on_start"] == "True":
@@ -69,7 +107,44 @@ def migrate(config):
         del config["options"]
 
 
+def migrate_anki(config):
+    # needs anki to be running, so this is done when anki is first used rather
+    # than every time the config is read
+    if not config.has_section("anki"):
+        return False
+
+    from plover_cards import anki_utils  # pylint: disable=import-outside-toplevel
+
+    note_type = ""
+
+    if config.has_option("anki", "card_type"):
+        note_type = config["anki"]["card_type"]
+
+    if config.has_option("anki", "note_type"):
+        note_type = config["anki"]["note_type"]
+
+    if note_type in anki_utils.invoke("modelNames"):
+        config["compare_to_anki"]["enabled"] = "yes"
+        config["compare_to_anki"]["query"] = f"note:{note_type}"
+        config["compare_to_anki"]["compare_field"] = anki_utils.invoke(
+            "modelFieldNames", modelName=note_type
+        )[0]
+
+        config["add_to_anki"]["enabled"] = "yes"
+        config["add_to_anki"]["note_type"] = note_type
+
+    del config["anki"]
+
+    return True
+
+
 def reset(config):
+    config["suggestions"] = {
+        # "current" for the system and dictionaries plover is using, "all", or a
+        # profile's key
+        "profile": "current",
+    }
+
     config["compare_ignore"] = {
         "enabled": "yes",
         "file_path": str(Path(PLOVER_CONFIG_DIR, "plover_cards", "ignore.txt")),
@@ -79,6 +154,9 @@ def reset(config):
         "enabled": "no",
         "query": "note:Basic",
         "compare_field": "Front",
+        # replace the strokes of existing notes when there's a shorter suggestion
+        "update_strokes": "no",
+        "strokes_field": "Back",
     }
 
     config["output_csv"] = {
@@ -96,22 +174,186 @@ def reset(config):
         "tags": "",
     }
 
+    config["hook"] = {
+        # same as in suggestions dialog and plover_clippy
+        "max_phrase_parts": "10",
+        # it's unlikely you'll have more than 5 translations per word for 10 words
+        "max_translations": "50",
+        # misstrokes are often only a key or two different
+        "misstroke_offset": "3",
+        # record suggestions for every Nth stroke
+        "sample_every": "1",
+        # above this many words per minute, only record phrases of up to
+        # high_wpm_max_phrase_parts words. 0 to disable
+        "high_wpm": "0",
+        "high_wpm_max_phrase_parts": "3",
+        # wait this many strokes before recording suggestions, so undone strokes
+        # aren't counted
+        "commit_delay": "3",
+    }
+
 
-def read():
+def read(write=True):
+    # write is False when reading again because the file changed, so someone
+    # editing it doesn't have it rewritten underneath them
     config = configparser.ConfigParser()
     reset(config)
 
     if not CONFIG_PATH.exists():
-        save(config)
-    else:
-        config.read(str(CONFIG_PATH))
-        migrate(config)
-        save(config)
+        if write:
+            save(config)
+        return config
+
+    text = CONFIG_PATH.read_text()
+    config.read_string(text)
+    migrate(config)
+    if write:
+        # only write if there were new defaults or something was migrated, not
+        # because of comments or spacing
+        in_file = configparser.ConfigParser()
+        in_file.read_string(text)
+        if as_dict(config) != as_dict(in_file):
+            save(config)
 
     return config
 
 
+def as_dict(config):
+    return {section: dict(config[section]) for section in config.sections()}
+
+
+def copy(config):
+    new_config = configparser.ConfigParser()
+    new_config.read_dict(config)
+    return new_config
+
+
+def parse(config):
+    def parse_section(section_type, section):
+        values = {}
+        for option in fields(section_type):
+            if option.type is bool:
+                values[option.name] = config.getboolean(section, option.name)
+            elif option.type is int:
+                values[option.name] = config.getint(section, option.name)
+            else:
+                values[option.name] = config.get(section, option.name)
+
+        return section_type(**values)
+
+    return Settings(
+        **{
+            section.name: parse_section(section.type, section.name)
+            for section in fields(Settings)
+        }
+    )
+
+
+def as_text(config):
+    with io.StringIO() as config_file:
+        config.write(config_file)
+        return config_file.getvalue()
+
+
 def save(config):
     CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with CONFIG_PATH.open("w") as config_file:
-        config.write(config_file)
+    CONFIG_PATH.write_text(as_text(config))
+
+
+def mtime():
+    try:
+        return CONFIG_PATH.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+class Config:
+    # shared between the hook, card builder and commands, so the file is only
+    # read again when it has changed
+    def __init__(self):
+        self.lock = RLock()
+        self.parser = None
+        self.settings = None
+        self.mtime = None
+        self.subscribers = []
+
+    def get(self):
+        self.reload_if_changed()
+        return self.settings
+
+    def reload_if_changed(self):
+        with self.lock:
+            first = self.settings is None
+            if not first and mtime() == self.mtime:
+                return False
+
+            try:
+                parser = read(write=first)
+                settings = parse(parser)
+            except (OSError, configparser.Error, ValueError) as e:
+                # only logged once, as the file isn't read again until it changes
+                log.error(f"plover_cards: can't read {CONFIG_PATH}: {e}")
+                self.mtime = mtime()
+                if not first:
+                    # keep the last settings which worked
+                    return False
+
+                parser = configparser.ConfigParser()
+                reset(parser)
+                settings = parse(parser)
+
+            # replaced rather than updated, so options removed from the file
+            # are removed here too
+            self.parser = parser
+            self.settings = settings
+            self.mtime = mtime()
+
+        self._notify()
+        return True
+
+    def copy(self):
+        # for the card builder to change, until it's saved
+        with self.lock:
+            if self.parser is None:
+                self.reload_if_changed()
+            return copy(self.parser)
+
+    def migrate_anki(self):
+        # the old [anki] section needs anki running to migrate, so this is
+        # tried whenever anki is about to be used. Raises OSError if anki isn't
+        # running, and the section is tried again next time
+        with self.lock:
+            if self.parser is None:
+                self.reload_if_changed()
+            if not self.parser.has_section("anki"):
+                return False
+
+            parser = copy(self.parser)
+            migrate_anki(parser)
+            self.save(parser)
+
+        return True
+
+    def save(self, parser):
+        with self.lock:
+            settings = parse(parser)
+            save(parser)
+            self.parser = copy(parser)
+            self.settings = settings
+            self.mtime = mtime()
+
+        self._notify()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def _notify(self):
+        for callback in list(self.subscribers):
+            callback(self.settings)
+
+
+CONFIG = Config()
@@ -1,9 +1,26 @@
-from pathlib import Path
+from array import array
+from collections.abc import Mapping
+import heapq
+from itertools import groupby, islice
+from operator import itemgetter
 import pickle
 from threading import Lock
 import time
 
-from plover.oslayer.config import CONFIG_DIR as PLOVER_CONFIG_DIR
+from . import snapshot
+
+# 1: {text: {"strokes": set(), ...}}
+# 2: {"version": 2, "card_suggestions": {text: {"strokes": {stroke: count}, ...}}}
+# 3: {"version": 3, "card_suggestions": {canonical(text): {"variants": ..., ...}}}
+# 4: strokes are kept most suggested first
+VERSION = 4
+# only keep the most suggested strokes for each phrase
+MAX_STROKES = 16
+# and the most used ways of writing it, e.g. "go" and "Go"
+MAX_VARIANTS = 4
+# daily counts are kept for this many days
+HISTORY_DAYS = 28
+DAY = 24 * 60 * 60
 
 
 def sync(func):
@@ -14,54 +31,450 @@ def sync(func):
     return f
 
 
+def strokes_sort_key(strokes):
+    # fewest strokes, then fewest keys
+    return (strokes.count("/"), len(strokes), strokes)
+
+
+def by_count(stroke_counts):
+    # most suggested first, then the shortest
+    return {
+        stroke: stroke_counts[stroke]
+        for stroke in sorted(
+            stroke_counts,
+            key=lambda stroke: (-stroke_counts[stroke], strokes_sort_key(stroke)),
+        )
+    }
+
+
+def canonical(text):
+    return text.strip().casefold()
+
+
+def display(key, data):
+    # the most used way of writing a phrase
+    variants = data.get("variants")
+    if not variants:
+        return key
+    # stores from before variants were stripped may have spaces
+    return max(variants, key=variants.get).strip()
+
+
+def migrate(card_suggestions, version):
+    if version < 2:
+        for data in card_suggestions.values():
+            data["strokes"] = {
+                stroke: 1 for stroke in sorted(data["strokes"], key=strokes_sort_key)
+            }
+
+    if version < 3:
+        found = {}
+        for text, data in card_suggestions.items():
+            found.setdefault(canonical(text), []).append((text.strip(), data))
+
+        merged = {}
+        for (key, variants) in found.items():
+            plain = set().union(
+                *(data["strokes"] for (text, data) in variants if text == key)
+            )
+            for (text, data) in variants:
+                if text != key:
+                    data["variants"] = {text: data["frequency"]}
+                    data["strokes"] = {
+                        stroke: data["strokes"][stroke]
+                        for stroke in without_capitalising(data["strokes"], plain)
+                    }
+
+                if key in merged:
+                    merge_data(merged[key], data, key)
+                else:
+                    merged[key] = data
+        card_suggestions = merged
+
+    if version < 4:
+        for data in card_suggestions.values():
+            data["strokes"] = by_count(data["strokes"])
+
+    return card_suggestions
+
+
+def without_capitalising(strokes, plain):
+    # the strokes for "Go" are mostly a capitalising stroke then the strokes for
+    # "go", e.g. KPA*/TKPWO, which don't belong on the card for "go"
+    return [
+        stroke
+        for stroke in strokes
+        if stroke in plain or stroke.partition("/")[2] not in plain
+    ]
+
+
+def top_counts(counts, limit):
+    return dict(sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit])
+
+
+def add_variants(data, key, texts):
+    # variants are only kept if a phrase isn't always written as its key
+    variants = data.get("variants")
+    if variants is None:
+        if all(text == key for text in texts):
+            return
+        variants = {key: data["frequency"]} if data["frequency"] > 0 else {}
+
+    for text in texts:
+        variants[text] = variants.get(text, 0) + 1
+    data["variants"] = top_counts(variants, MAX_VARIANTS)
+
+
+def add_strokes(stroke_counts, strokes):
+    # space-saving top-k: when full, the least suggested stroke makes way for the
+    # new one, which takes over its count. Of those suggested as often, the
+    # longest goes
+    for stroke in strokes:
+        if stroke in stroke_counts:
+            stroke_counts[stroke] += 1
+            continue
+
+        count = 1
+        if len(stroke_counts) >= MAX_STROKES:
+            evicted = max(
+                stroke_counts,
+                key=lambda stroke: (-stroke_counts[stroke], strokes_sort_key(stroke)),
+            )
+            count = stroke_counts.pop(evicted) + 1
+        stroke_counts[stroke] = count
+
+    # kept in display order so the card builder doesn't need to sort them
+    return by_count(stroke_counts)
+
+
+def today(now=None):
+    return int((time.time() if now is None else now) // DAY)
+
+
+def add_to_history(data, day, count=1):
+    # data["history"] is a ring buffer of daily counts, where
+    # data["history"][d % HISTORY_DAYS] is the count for day d, up to
+    # data["history_day"]
+    history = data.get("history")
+    if history is None:
+        history = array("I", bytes(4 * HISTORY_DAYS))
+        data["history"] = history
+        data["history_day"] = day
+    elif day <= data["history_day"] - HISTORY_DAYS:
+        # too old to keep
+        return
+    else:
+        for d in range(max(data["history_day"] + 1, day - HISTORY_DAYS + 1), day + 1):
+            history[d % HISTORY_DAYS] = 0
+        data["history_day"] = max(day, data["history_day"])
+
+    history[day % HISTORY_DAYS] += count
+
+
+def merge_data(data, other, key):
+    if "variants" in data or "variants" in other:
+        variants = dict(data.get("variants") or {key: data["frequency"]})
+        for text, count in (other.get("variants") or {key: other["frequency"]}).items():
+            variants[text] = variants.get(text, 0) + count
+        data["variants"] = top_counts(variants, MAX_VARIANTS)
+
+    data["frequency"] += other["frequency"]
+    data["frequency_shorter"] = data.get("frequency_shorter", 0) + other.get(
+        "frequency_shorter", 0
+    )
+    data["last_updated"] = max(
+        data.get("last_updated") or 0, other.get("last_updated") or 0
+    )
+
+    stroke_counts = dict(data["strokes"])
+    for stroke, count in other["strokes"].items():
+        stroke_counts[stroke] = stroke_counts.get(stroke, 0) + count
+    data["strokes"] = dict(islice(by_count(stroke_counts).items(), MAX_STROKES))
+
+    history = other.get("history")
+    if history is not None:
+        last_day = other["history_day"]
+        for day in range(last_day - HISTORY_DAYS + 1, last_day + 1):
+            if history[day % HISTORY_DAYS] > 0:
+                add_to_history(data, day, history[day % HISTORY_DAYS])
+
+
+def recent_frequency(data, days, day=None):
+    history = data.get("history")
+    if history is None:
+        return 0
+    if day is None:
+        day = today()
+
+    end = min(day, data["history_day"])
+    start = max(day - days, data["history_day"] - HISTORY_DAYS) + 1
+    return sum(history[d % HISTORY_DAYS] for d in range(start, end + 1))
+
+
 class CardSuggestions:
-    PATH = Path(PLOVER_CONFIG_DIR, "plover_cards", "card_suggestions.pickle")
     lock = Lock()
 
-    def __init__(self):
-        self.load()
+    def __init__(self, profile=None, load=True):
+        # without a profile, nothing is loaded or saved
+        self.profile = profile
         self.changed = False
+        # key -> generation it was last changed in, so the card builder can
+        # find what's changed while it's open
+        self.generation = 0
+        self.updated = {}
+        if load and profile is not None:
+            self.load()
+        else:
+            self.card_suggestions = {}
 
     @sync
     def load(self):
         self.card_suggestions = {}
-        if self.PATH.exists():
-            with self.PATH.open("rb") as f:
-                self.card_suggestions = pickle.load(f)
+        path = self.profile.path(".pickle")
+        if path.exists():
+            with path.open("rb") as f:
+                data = pickle.load(f)
+
+            if isinstance(data.get("version"), int):
+                version = data["version"]
+                data = data["card_suggestions"]
+            else:
+                version = 1
+
+            self.card_suggestions = migrate(data, version)
+            if version < VERSION:
+                self.changed = True
+
+        self._apply_deleted()
 
     @sync
     def save(self):
+        if self.profile is None:
+            return
+
+        self._apply_deleted()
         if not self.changed:
             return
 
-        with self.PATH.open("wb") as f:
-            pickle.dump(self.card_suggestions, f)
+        path = self.profile.path(".pickle")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as f:
+            pickle.dump(
+                {"version": VERSION, "card_suggestions": self.card_suggestions}, f
+            )
+        snapshot.clear_deleted(self.profile.path(".deleted"))
 
         self.changed = False
 
+    def close(self):
+        # also writes the snapshot, so the card builder can open this profile
+        # without loading every suggestion when the hook isn't recording it
+        self.save()
+        if self.profile is None or not self.profile.path(".pickle").exists():
+            return
+
+        result = open_snapshot(self.profile)
+        if result is None:
+            self.write_snapshot()
+        else:
+            result.close()
+
+    def _apply_deleted(self):
+        # deleted from a snapshot in the card builder
+        for text in snapshot.read_deleted(self.profile.path(".deleted")):
+            if self.card_suggestions.pop(text, None) is not None:
+                self.changed = True
+
+    @sync
+    def write_snapshot(self):
+        try:
+            snapshot.write(
+                self.profile.path(".snapshot"),
+                self.card_suggestions,
+                VERSION,
+                HISTORY_DAYS,
+            )
+        except OSError:
+            # e.g. the card builder has it open on windows, it'll be out of date
+            # so won't be used
+            pass
+
     @sync
-    def add_suggestion(self, suggestion, is_shorter=False):
-        text = suggestion.text
-        stroke_suggestions = ["/".join(s) for s in suggestion.steno_list]
+    def add_suggestion(self, suggestions, is_shorter=False, now=None):
+        # suggestions for the same phrase written different ways, e.g. "go" and
+        # "Go", which are counted once
+        key = canonical(suggestions[0].text)
+        texts = list(
+            dict.fromkeys(suggestion.text.strip() for suggestion in suggestions)
+        )
+        stroke_suggestions = list(
+            dict.fromkeys(
+                "/".join(s) for suggestion in suggestions for s in suggestion.steno_list
+            )
+        )
+        if now is None:
+            now = time.time()
 
-        if self.card_suggestions.get(text) is None:
-            self.card_suggestions[text] = {
+        data = self.card_suggestions.get(key)
+        if data is None:
+            data = {
                 "frequency": 0,
-                "last_updated": time.time(),
-                "strokes": set(),
+                "last_updated": now,
+                "strokes": {},
                 "frequency_shorter": 0,
             }
+            self.card_suggestions[key] = data
 
-        self.card_suggestions[text]["frequency"] += 1
-        self.card_suggestions[text]["last_updated"] = time.time()
-        self.card_suggestions[text]["strokes"].update(stroke_suggestions)
+        add_variants(data, key, texts)
+        plain = set(
+            "/".join(s)
+            for suggestion in suggestions
+            if suggestion.text.strip() == key
+            for s in suggestion.steno_list
+        ).union(data["strokes"])
+        stroke_suggestions = without_capitalising(stroke_suggestions, plain)
+        data["frequency"] += 1
+        data["last_updated"] = now
+        add_to_history(data, today(now))
+        data["strokes"] = add_strokes(data["strokes"], stroke_suggestions)
         if is_shorter:
-            self.card_suggestions[text]["frequency_shorter"] = (
-                self.card_suggestions[text].get("frequency_shorter", 0) + 1
-            )
+            data["frequency_shorter"] = data.get("frequency_shorter", 0) + 1
 
         self.changed = True
+        self.generation += 1
+        self.updated[key] = self.generation
+
+    @sync
+    def items(self):
+        # a copy, so the hook can keep adding suggestions while it's used
+        return list(self.card_suggestions.items())
+
+    @sync
+    def merge(self, card_suggestions):
+        for key, other in card_suggestions.items():
+            data = self.card_suggestions.get(key)
+            if data is None:
+                self.card_suggestions[key] = other
+            else:
+                merge_data(data, other, key)
+
+        if card_suggestions:
+            self.changed = True
+            self.generation += 1
+            self.updated.update(dict.fromkeys(card_suggestions, self.generation))
 
     @sync
-    def delete(self, text):
-        del self.card_suggestions[text]
+    def updated_since(self, generation):
+        return [key for key, updated in self.updated.items() if updated > generation]
+
+    @sync
+    def delete(self, key):
+        del self.card_suggestions[key]
+        self.changed = True
+
+
+def open_snapshot(profile):
+    return snapshot.Snapshot.open(
+        profile.path(".snapshot"),
+        profile.path(".pickle"),
+        profile.path(".deleted"),
+        VERSION,
+    )
+
+
+def read_only(profile):
+    # for looking at a profile's suggestions when the hook isn't recording them,
+    # without loading all of them. The hook writes the snapshot when it stops or
+    # moves on to another profile, so it's only written here if plover was closed
+    # without stopping the hook
+    result = open_snapshot(profile)
+    if result is None:
+        card_suggestions = CardSuggestions(profile)
+        card_suggestions.write_snapshot()
+        result = open_snapshot(profile)
+        if result is None:
+            return card_suggestions
+
+    return result
+
+
+def read_all(profiles, live=None):
+    # every profile's suggestions together. live is the hook's store, if it's
+    # recording suggestions for one of them
+    if live is not None and live.profile in profiles:
+        live.save()
+        live.write_snapshot()
+
+    return CombinedSuggestions([read_only(profile) for profile in profiles])
+
+
+class CombinedView(Mapping):
+    # looks like the card_suggestions dict, with phrases from more than one
+    # profile merged together
+    def __init__(self, stores):
+        self.stores = stores
+
+    def __len__(self):
+        return sum(1 for _item in self.items())
+
+    def __iter__(self):
+        for (phrase, _data) in self.items():
+            yield phrase
+
+    def __getitem__(self, phrase):
+        found = [
+            store.card_suggestions[phrase]
+            for store in self.stores
+            if phrase in store.card_suggestions
+        ]
+        if len(found) == 0:
+            raise KeyError(phrase)
+
+        return combine(phrase, found)
+
+    def items(self):
+        # snapshots are sorted by phrase, so the same phrase from each store
+        # comes out together
+        merged = heapq.merge(
+            *(
+                store.items()
+                if isinstance(store, snapshot.Snapshot)
+                else sorted(store.items(), key=itemgetter(0))
+                for store in self.stores
+            ),
+            key=itemgetter(0),
+        )
+        for (phrase, group) in groupby(merged, key=itemgetter(0)):
+            yield (phrase, combine(phrase, [data for (_phrase, data) in group]))
+
+
+def combine(key, found):
+    if len(found) == 1:
+        return found[0]
+
+    data = dict(found[0])
+    if data.get("history") is not None:
+        # added to in place
+        data["history"] = array("I", data["history"])
+    for other in found[1:]:
+        merge_data(data, other, key)
+
+    return data
+
+
+class CombinedSuggestions:
+    def __init__(self, stores):
+        self.stores = stores
+        self.card_suggestions = CombinedView(stores)
+
+    def items(self):
+        return self.card_suggestions.items()
+
+    def delete(self, key):
+        for store in self.stores:
+            if key in store.card_suggestions:
+                store.delete(key)
+
+    def close(self):
+        for store in self.stores:
+            store.close()
@@ -0,0 +1,131 @@
+from threading import Lock
+
+# used as the number of keys when there's no one stroke outline
+NO_ONE_STROKE = 1000
+
+
+def index_entries(entries):
+    # translation -> (fewest strokes, fewest keys in a one stroke outline)
+    index = {}
+    for strokes, translation in entries:
+        num_keys = len(strokes[0]) if len(strokes) == 1 else NO_ONE_STROKE
+        shortest = index.get(translation)
+        if shortest is None:
+            index[translation] = (len(strokes), num_keys)
+        elif len(strokes) < shortest[0] or num_keys < shortest[1]:
+            index[translation] = (
+                min(len(strokes), shortest[0]),
+                min(num_keys, shortest[1]),
+            )
+
+    return index
+
+
+def shadowed_keys(dictionary, earlier):
+    # keys which a higher priority dictionary also has, so they're never looked
+    # up in this one. Usually one of them is a small user dictionary, so only
+    # that one's keys are checked
+    keys = set()
+    for other in earlier:
+        (smaller, larger) = sorted((other, dictionary), key=len)
+        keys.update(strokes for strokes in smaller if strokes in larger)
+
+    return keys
+
+
+def visible_index(dictionary, index, shadowed):
+    # the index of only the entries plover would use
+    if not shadowed:
+        return index
+
+    translations = {dictionary[strokes] for strokes in shadowed}
+    index = {
+        translation: shortest
+        for translation, shortest in index.items()
+        if translation not in translations
+    }
+    index.update(
+        index_entries(
+            (strokes, translation)
+            for translation in translations
+            for strokes in dictionary.reverse_lookup(translation)
+            if strokes not in shadowed
+        )
+    )
+
+    return index
+
+
+def state(dictionaries):
+    return [(d.path, d.enabled, d.timestamp) for d in dictionaries.dicts]
+
+
+class OutlineIndex:
+    def __init__(self):
+        self.lock = Lock()
+        # path -> (timestamp, index), so only changed dictionaries are re-indexed
+        self.dictionary_indexes = {}
+        self.index = {}
+        self.state = None
+
+    def update_if_changed(self, dictionaries):
+        # dictionaries_loaded isn't triggered when a translation is added or a
+        # dictionary is turned on or off, but the timestamp changes when it's
+        # saved
+        if state(dictionaries) != self.state:
+            self.update(dictionaries)
+
+    def update(self, dictionaries):
+        dictionary_indexes = {}
+        visible_indexes = []
+        earlier = []
+        for dictionary in dictionaries.dicts:
+            if not dictionary.enabled:
+                continue
+
+            cached = self.dictionary_indexes.get(dictionary.path)
+            if cached is None or cached[0] != dictionary.timestamp:
+                cached = (dictionary.timestamp, index_entries(dictionary.items()))
+            dictionary_indexes[dictionary.path] = cached
+            visible_indexes.append(
+                visible_index(
+                    dictionary, cached[1], shadowed_keys(dictionary, earlier)
+                )
+            )
+            earlier.append(dictionary)
+
+        merged = {}
+        for index in visible_indexes:
+            for translation, (num_strokes, num_keys) in index.items():
+                shortest = merged.get(translation)
+                if shortest is None:
+                    merged[translation] = (num_strokes, num_keys)
+                elif num_strokes < shortest[0] or num_keys < shortest[1]:
+                    merged[translation] = (
+                        min(num_strokes, shortest[0]),
+                        min(num_keys, shortest[1]),
+                    )
+
+        with self.lock:
+            self.dictionary_indexes = dictionary_indexes
+            self.index = merged
+            self.state = state(dictionaries)
+
+    def is_shorter(self, translation, strokes, misstroke_offset):
+        with self.lock:
+            shortest = self.index.get(translation)
+
+        if shortest is None or len(strokes) == 0:
+            return False
+
+        (num_strokes, num_keys) = shortest
+        return (
+            # there are fewer overall strokes
+            num_strokes < len(strokes)
+            or (
+                # there is one stroke which is at least misstroke_offset
+                # characters shorter
+                len(strokes) == 1
+                and num_keys + misstroke_offset <= len(strokes[0])
+            )
+        )
@@ -1,20 +1,25 @@
+from collections import deque
 import re
 from threading import Timer
+import time
 
 from plover.formatting import RetroFormatter
 from plover.translation import escape_translation
 
-from .card_suggestions import CardSuggestions
-
-# same as in suggestions dialog and plover_clippy
-MAX_PHRASE_PARTS = 10
-# it's unlikely you'll have more than 5 translations per word for 10 words
-MAX_TRANSLATIONS = 50
-# misstrokes are often only a key or two different
-MISSTROKE_OFFSET = 3
+from plover_cards import config
+from plover_cards.anki_outbox import OUTBOX
+from .card_suggestions import CardSuggestions, canonical
+from .outline_index import OutlineIndex
+from . import profiles
 
 # 5 minutes
 SAVE_INTERVAL = 300
+# how often to check whether plover_cards.cfg has changed, in seconds
+CONFIG_CHECK_INTERVAL = 2
+# and whether a dictionary has changed without being loaded again
+DICTIONARY_CHECK_INTERVAL = 2
+# words per minute are measured over the last WPM_WINDOW seconds
+WPM_WINDOW = 20
 
 
 class Main:
@@ -23,20 +28,49 @@ class Main:
     # https://github.com/openstenoproject/plover/blob/91a84e16403e9d7470d0192c3b5484e422060a0b/plover/gui_qt/suggestions_dialog.py#L36
     WORD_RX = re.compile(r"(?:\w+|[^\w\s]+)\s*")
 
-    def __init__(self, engine):
+    def __init__(self, engine, card_suggestions=None):
         super().__init__()
         self.engine = engine
 
-        self.card_suggestions = CardSuggestions()
-        self._on_timer()
+        # loaded in start, once the engine's system and dictionaries are known
+        self.card_suggestions = card_suggestions
+        self.outline_index = OutlineIndex()
+        self._on_config_changed(config.CONFIG.get())
+        self.config_checked = time.time()
+        self.dictionaries_checked = time.time()
+        self.stroke_count = 0
+        self.stroke_times = deque()
+        # (translation, phrases, phrase_strokes, time) for strokes that could still
+        # be undone
+        self.pending = deque()
+        # replaced when replaying strokes from a log
+        self.clock = time.time
+        # saves the suggestions every SAVE_INTERVAL, once started
+        self.timer = None
 
     def start(self):
+        with self.engine:
+            self._use_profile(profiles.from_config(self.engine.config))
+            self.outline_index.update(self.engine.dictionaries)
+        self._on_timer()
+        config.CONFIG.subscribe(self._on_config_changed)
+        self.engine.hook_connect("dictionaries_loaded", self._on_dictionaries_loaded)
         self.engine.hook_connect("translated", self._on_translated)
+        # send anything that couldn't be sent to anki last time
+        if len(OUTBOX) > 0:
+            OUTBOX.start()
 
     def stop(self):
         self.engine.hook_disconnect("translated", self._on_translated)
-        self.card_suggestions.save()
-        self.timer.cancel()
+        self.engine.hook_disconnect(
+            "dictionaries_loaded", self._on_dictionaries_loaded
+        )
+        config.CONFIG.unsubscribe(self._on_config_changed)
+        self.flush()
+        self.card_suggestions.close()
+        if self.timer is not None:
+            self.timer.cancel()
+        OUTBOX.stop()
 
     def _on_timer(self):
         self.card_suggestions.save()
@@ -44,14 +78,85 @@ class Main:
         self.timer = Timer(SAVE_INTERVAL, self._on_timer)
         self.timer.start()
 
-    def _on_translated(self, _old, new):
+    def flush(self):
+        while self.pending:
+            self._commit(*self.pending.popleft())
+
+    def _on_dictionaries_loaded(self, dictionaries):
+        # also loaded again when the system changes
+        self.outline_index.update(dictionaries)
+        self._use_profile(profiles.from_config(self.engine.config))
+
+    def _use_profile(self, profile):
+        # only the current profile's suggestions are kept in memory
+        if self.card_suggestions is not None:
+            if self.card_suggestions.profile == profile:
+                return
+
+            # suggestions for the pending strokes would come from the new
+            # dictionaries, so they're dropped
+            self.pending.clear()
+            self.card_suggestions.close()
+
+        profiles.remember(profile)
+        self.card_suggestions = CardSuggestions(profile)
+
+    def _on_config_changed(self, settings):
+        self.settings = settings.hook
+
+    def _reload_config(self, now):
+        if now - self.config_checked < CONFIG_CHECK_INTERVAL:
+            return
+        self.config_checked = now
+
+        config.CONFIG.reload_if_changed()
+
+    def _update_outline_index(self, now):
+        if now - self.dictionaries_checked < DICTIONARY_CHECK_INTERVAL:
+            return
+        self.dictionaries_checked = now
+
+        self.outline_index.update_if_changed(self.engine.dictionaries)
+
+    def _wpm(self, now):
+        # each stroke is counted as a word, which is close enough to tell when
+        # someone is writing quickly
+        self.stroke_times.append(now)
+        while self.stroke_times[0] < now - WPM_WINDOW:
+            self.stroke_times.popleft()
+
+        return len(self.stroke_times) * 60 / WPM_WINDOW
+
+    def _on_translated(self, old, new):
+        # undone or replaced translations shouldn't be counted, e.g. "let" when
+        # "HRET/-S" becomes "lets"
+        if old and self.pending:
+            self.pending = deque(
+                entry
+                for entry in self.pending
+                if not any(entry[0] is translation for translation in old)
+            )
+
         if len(new) == 0:
             # true if the stroke is an undo stroke
             return
 
+        now = self.clock()
+        self._reload_config(time.time())
+        self._update_outline_index(time.time())
+
+        settings = self.settings
+        max_phrase_parts = settings.max_phrase_parts
+        if settings.high_wpm > 0 and self._wpm(now) >= settings.high_wpm:
+            max_phrase_parts = min(max_phrase_parts, settings.high_wpm_max_phrase_parts)
+
+        self.stroke_count += 1
+        if self.stroke_count % max(settings.sample_every, 1) != 0:
+            return
+
         with self.engine:
             last_translations = self.engine.translator_state.translations[
-                -MAX_TRANSLATIONS:
+                -settings.max_translations :
             ]
 
         if len(last_translations) == 0:
@@ -74,7 +179,7 @@ class Main:
             )
         ]
         retro_formatter = RetroFormatter(last_translations)
-        split_words = retro_formatter.last_words(MAX_PHRASE_PARTS, rx=self.WORD_RX)
+        split_words = retro_formatter.last_words(max_phrase_parts, rx=self.WORD_RX)
 
         # last few "phrases", e.g. "let's go", "'s go", "s go", "go"
         phrases.update(set("".join(split_words[i:]) for i in range(len(split_words))))
@@ -91,7 +196,7 @@ class Main:
             translations = last_translations[i:]
             phrase = "".join(
                 RetroFormatter(translations).last_words(
-                    MAX_PHRASE_PARTS, rx=self.WORD_RX
+                    max_phrase_parts, rx=self.WORD_RX
                 )
             )
 
@@ -105,23 +210,29 @@ class Main:
 
             phrase_strokes[phrase] = strokes
 
+        self.pending.append((new[-1], phrases, phrase_strokes, now))
+        while len(self.pending) > settings.commit_delay:
+            self._commit(*self.pending.popleft())
+
+    def _commit(self, _translation, phrases, phrase_strokes, now):
+        settings = self.settings
+        # canonical phrase -> ([suggestion], is_shorter), so different ways of
+        # writing the same phrase are only counted once
+        found = {}
         for phrase in phrases:
             strokes = phrase_strokes.get(phrase, "")
             with self.engine:
                 suggestions = self.engine.get_suggestions(phrase)
             for suggestion in suggestions:
-                self.card_suggestions.add_suggestion(
-                    suggestion,
-                    # is shorter if
-                    any(
-                        # there are fewer overall strokes
-                        (len(s) < len(strokes))
-                        or (
-                            # there is one stroke which is at least MISSTROKE_OFFSET
-                            # characters shorter
-                            len(s) == 0
-                            and len(s[0]) + MISSTROKE_OFFSET <= len(strokes[0])
-                        )
-                        for s in suggestion.steno_list
-                    ),
+                is_shorter = self.outline_index.is_shorter(
+                    suggestion.text, strokes, settings.misstroke_offset
                 )
+                key = canonical(suggestion.text)
+                if key in found:
+                    found[key][0].append(suggestion)
+                    found[key] = (found[key][0], found[key][1] or is_shorter)
+                else:
+                    found[key] = ([suggestion], is_shorter)
+
+        for (suggestions, is_shorter) in found.values():
+            self.card_suggestions.add_suggestion(suggestions, is_shorter, now)
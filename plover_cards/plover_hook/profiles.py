@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+import hashlib
+import json
+from pathlib import Path
+import time
+from typing import Tuple
+
+from plover.oslayer.config import CONFIG_DIR as PLOVER_CONFIG_DIR
+
+# Suggestions are kept separately for each steno system and set of dictionaries,
+# in DIR/<key>.pickle, DIR/<key>.snapshot and DIR/<key>.deleted
+DIR = Path(PLOVER_CONFIG_DIR, "plover_cards", "profiles")
+# key -> {"system_name": ..., "dictionaries": [...], "last_used": ...}
+INDEX_PATH = Path(DIR, "profiles.json")
+# where everything was kept before there were profiles
+LEGACY_DIR = Path(PLOVER_CONFIG_DIR, "plover_cards")
+
+# card builder choices, other than a profile's key
+CURRENT = "current"
+ALL = "all"
+
+
+@dataclass(frozen=True)
+class Profile:
+    system_name: str
+    dictionaries: Tuple[str, ...]
+
+    @property
+    def key(self):
+        text = "\n".join((self.system_name,) + self.dictionaries)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def name(self):
+        names = ", ".join(Path(path).name for path in self.dictionaries)
+        return f"{self.system_name} ({names})"
+
+    def path(self, suffix):
+        return Path(DIR, f"{self.key}{suffix}")
+
+
+def from_config(plover_config):
+    # the order and whether they're enabled can change without starting again
+    return Profile(
+        plover_config["system_name"],
+        tuple(sorted(set(d.path for d in plover_config["dictionaries"]))),
+    )
+
+
+def read_index():
+    if not INDEX_PATH.exists():
+        return {}
+
+    try:
+        return json.loads(INDEX_PATH.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def load_all():
+    # most recently used first
+    index = read_index()
+    return [
+        Profile(entry["system_name"], tuple(entry["dictionaries"]))
+        for entry in sorted(
+            index.values(), key=lambda entry: entry["last_used"], reverse=True
+        )
+    ]
+
+
+def find(key):
+    entry = read_index().get(key)
+    if entry is None:
+        return None
+    return Profile(entry["system_name"], tuple(entry["dictionaries"]))
+
+
+def remember(profile):
+    index = read_index()
+    if len(index) == 0:
+        adopt_legacy(profile)
+
+    index[profile.key] = {
+        "system_name": profile.system_name,
+        "dictionaries": list(profile.dictionaries),
+        "last_used": time.time(),
+    }
+
+    DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = INDEX_PATH.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(index, indent=2))
+    tmp_path.replace(INDEX_PATH)
+
+
+def adopt_legacy(profile):
+    # suggestions recorded before there were profiles go to the first one used
+    DIR.mkdir(parents=True, exist_ok=True)
+    for suffix in (".pickle", ".deleted"):
+        legacy_path = Path(LEGACY_DIR, f"card_suggestions{suffix}")
+        if legacy_path.exists() and not profile.path(suffix).exists():
+            legacy_path.replace(profile.path(suffix))
+
+    legacy_snapshot = Path(LEGACY_DIR, "card_suggestions.snapshot")
+    if legacy_snapshot.exists():
+        legacy_snapshot.unlink()
@@ -0,0 +1,300 @@
+from array import array
+from collections.abc import Mapping
+import json
+import mmap
+import os
+import struct
+
+# A read-only copy of the suggestion store that can be opened without unpickling
+# everything:
+#   header
+#   rows, sorted by the utf-8 phrase
+#   history, HISTORY_DAYS counts for each row
+#   phrases
+#   strokes, "stroke\tcount\tstroke\tcount..." for each row
+#   variants, json for the rows that have them
+MAGIC = b"PCSNAP02"
+# magic, store version, history days, number of rows, size of the phrases, size of
+# the strokes
+HEADER = struct.Struct("<8sIIIII")
+# phrase offset, phrase length, frequency, frequency_shorter, last_updated,
+# history_day, strokes offset, strokes length, variants offset, variants length
+ROW = struct.Struct("<IIIIdiIIII")
+# same as array("I")
+HISTORY = struct.Struct("<I")
+NO_HISTORY = -1
+
+
+def write(path, card_suggestions, version, history_days):
+    rows = []
+    history = array("I")
+    empty_history = bytes(HISTORY.size * history_days)
+    phrases = bytearray()
+    strokes = bytearray()
+    variants = bytearray()
+    for (phrase, data) in sorted(
+        ((phrase.encode("utf-8"), data) for phrase, data in card_suggestions.items()),
+        key=lambda item: item[0],
+    ):
+        stroke_text = "\t".join(
+            f"{stroke}\t{count}" for stroke, count in data["strokes"].items()
+        ).encode("utf-8")
+        variant_text = b""
+        if data.get("variants"):
+            variant_text = json.dumps(data["variants"]).encode("utf-8")
+        rows.append(
+            ROW.pack(
+                len(phrases),
+                len(phrase),
+                data["frequency"],
+                data.get("frequency_shorter", 0),
+                data.get("last_updated") or 0,
+                data.get("history_day", NO_HISTORY),
+                len(strokes),
+                len(stroke_text),
+                len(variants),
+                len(variant_text),
+            )
+        )
+        if data.get("history") is None:
+            history.frombytes(empty_history)
+        else:
+            history.extend(data["history"])
+        phrases += phrase
+        strokes += stroke_text
+        variants += variant_text
+
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC, version, history_days, len(rows), len(phrases), len(strokes)
+            )
+        )
+        f.write(b"".join(rows))
+        f.write(history.tobytes())
+        f.write(phrases)
+        f.write(strokes)
+        f.write(variants)
+    tmp_path.replace(path)
+
+
+class SnapshotView(Mapping):
+    # looks like the card_suggestions dict, but only reads the rows asked for
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return self.snapshot.count - len(self.snapshot.deleted)
+
+    def __iter__(self):
+        for (phrase, _data) in self.items():
+            yield phrase
+
+    def __getitem__(self, phrase):
+        if phrase in self.snapshot.deleted:
+            raise KeyError(phrase)
+
+        i = self.snapshot.find(phrase)
+        if i is None:
+            raise KeyError(phrase)
+
+        return self.snapshot.row(i)[1]
+
+    def items(self):
+        return self.snapshot.rows(0, self.snapshot.count)
+
+
+class Snapshot:
+    # phrases deleted from the snapshot are appended to deleted_path, and removed
+    # from the store the next time it's loaded
+    def __init__(self, f, path, source_path, deleted_path):
+        self.file = f
+        self.path = path
+        self.source_path = source_path
+        self.deleted_path = deleted_path
+        self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            _magic,
+            self.version,
+            self.history_days,
+            self.count,
+            phrases_size,
+            strokes_size,
+        ) = HEADER.unpack_from(self.mm)
+
+        self.history_offset = HEADER.size + self.count * ROW.size
+        self.phrases_offset = (
+            self.history_offset + self.count * self.history_days * HISTORY.size
+        )
+        self.strokes_offset = self.phrases_offset + phrases_size
+        self.variants_offset = self.strokes_offset + strokes_size
+        self.deleted = set(
+            phrase
+            for phrase in read_deleted(deleted_path)
+            if self.find(phrase) is not None
+        )
+        self.card_suggestions = SnapshotView(self)
+
+    @classmethod
+    def open(cls, path, source_path, deleted_path, version):
+        # None if there isn't an up to date snapshot of source_path
+        try:
+            if path.stat().st_mtime < source_path.stat().st_mtime:
+                return None
+
+            f = path.open("rb")
+        except OSError:
+            return None
+
+        try:
+            header = f.read(HEADER.size)
+            if (
+                len(header) < HEADER.size
+                or HEADER.unpack(header)[0] != MAGIC
+                or HEADER.unpack(header)[1] != version
+            ):
+                f.close()
+                return None
+
+            return cls(f, path, source_path, deleted_path)
+        except (OSError, ValueError, struct.error):
+            f.close()
+            return None
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def identity(self):
+        stat = os.fstat(self.file.fileno())
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def handle(self):
+        # enough to open the same snapshot in another process
+        return (
+            self.path,
+            self.source_path,
+            self.deleted_path,
+            self.identity(),
+            self.deleted,
+        )
+
+    @classmethod
+    def from_handle(cls, handle):
+        # raises OSError if the file has been replaced since
+        (path, source_path, deleted_path, identity, deleted) = handle
+        result = cls(path.open("rb"), path, source_path, deleted_path)
+        if result.identity() != identity:
+            result.close()
+            raise OSError(f"{path} has been replaced")
+
+        result.deleted = deleted
+        return result
+
+    def phrase(self, i):
+        (offset, length) = ROW.unpack_from(self.mm, HEADER.size + i * ROW.size)[:2]
+        start = self.phrases_offset + offset
+        return self.mm[start : start + length]
+
+    def find(self, phrase):
+        # binary search over the sorted phrases
+        key = phrase.encode("utf-8")
+        (low, high) = (0, self.count)
+        while low < high:
+            middle = (low + high) // 2
+            if self.phrase(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.count and self.phrase(low) == key:
+            return low
+        return None
+
+    def row(self, i):
+        (
+            phrase_offset,
+            phrase_length,
+            frequency,
+            frequency_shorter,
+            last_updated,
+            history_day,
+            strokes_offset,
+            strokes_length,
+            variants_offset,
+            variants_length,
+        ) = ROW.unpack_from(self.mm, HEADER.size + i * ROW.size)
+
+        start = self.phrases_offset + phrase_offset
+        phrase = self.mm[start : start + phrase_length].decode("utf-8")
+
+        strokes = {}
+        if strokes_length > 0:
+            start = self.strokes_offset + strokes_offset
+            parts = self.mm[start : start + strokes_length].decode("utf-8").split("\t")
+            for (stroke, count) in zip(parts[::2], parts[1::2]):
+                strokes[stroke] = int(count)
+
+        data = {
+            "frequency": frequency,
+            "frequency_shorter": frequency_shorter,
+            "last_updated": last_updated or None,
+            "strokes": strokes,
+        }
+        if history_day != NO_HISTORY:
+            size = self.history_days * HISTORY.size
+            start = self.history_offset + i * size
+            history = array("I")
+            history.frombytes(self.mm[start : start + size])
+            data["history"] = history
+            data["history_day"] = history_day
+        if variants_length > 0:
+            start = self.variants_offset + variants_offset
+            data["variants"] = json.loads(self.mm[start : start + variants_length])
+
+        return (phrase, data)
+
+    def rows(self, start, stop):
+        for i in range(start, stop):
+            (phrase, data) = self.row(i)
+            if phrase not in self.deleted:
+                yield (phrase, data)
+
+    def items(self):
+        return self.card_suggestions.items()
+
+    def delete(self, text):
+        if text in self.deleted or self.find(text) is None:
+            return
+
+        self.deleted.add(text)
+        self.deleted_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.deleted_path.open("a") as f:
+            f.write(json.dumps(text))
+            f.write("\n")
+
+    def save(self):
+        # deletes are written as they happen
+        pass
+
+
+def read_deleted(path):
+    if not path.exists():
+        return []
+
+    deleted = []
+    with path.open() as f:
+        for line in f:
+            try:
+                deleted.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the last line may be cut off if plover was killed
+                continue
+
+    return deleted
+
+
+def clear_deleted(path):
+    if path.exists():
+        path.unlink()
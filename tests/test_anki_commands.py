@@ -0,0 +1,135 @@
+from pathlib import Path
+import socket
+import tempfile
+import time
+from threading import Event
+import unittest
+from unittest import mock
+import urllib.error
+
+from plover_cards import anki_utils
+from plover_cards import config
+from plover_cards.commands import anki_commands
+
+
+class AddCardWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.worker = anki_commands.AddCardWorker()
+        self.added = []
+        self.adding = Event()
+        self.answer = Event()
+
+        def add_card(engine, text):
+            self.adding.set()
+            self.answer.wait(5)
+            self.added.append((engine, text))
+
+        patch = mock.patch.object(self.worker, "_add_card", side_effect=add_card)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(self.answer.set)
+
+    def wait_for_added(self, count):
+        for _ in range(500):
+            if len(self.added) >= count:
+                return
+            time.sleep(0.01)
+        raise AssertionError("timed out")
+
+    def test_adds_every_text_in_order(self):
+        self.worker.add("engine", "one")
+        self.adding.wait(5)
+        # while anki is busy with the first
+        self.worker.add("engine", "two")
+        self.worker.add("engine", "three")
+        self.answer.set()
+
+        self.wait_for_added(3)
+        self.assertEqual([text for (_, text) in self.added], ["one", "two", "three"])
+
+    def test_adds_the_same_text_once(self):
+        self.worker.add("engine", "one")
+        self.adding.wait(5)
+        self.worker.add("engine", "two")
+        self.worker.add("engine", "three")
+        self.worker.add("other engine", "two")
+        self.answer.set()
+
+        self.wait_for_added(3)
+        self.assertEqual(
+            self.added,
+            [("engine", "one"), ("other engine", "two"), ("engine", "three")],
+        )
+
+
+class FakeEngine:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get_suggestions(self, text):
+        return []
+
+
+class AddCardTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.outbox = mock.Mock()
+        for patch in (
+            mock.patch.object(anki_commands, "OUTBOX", self.outbox),
+            mock.patch.object(config, "CONFIG_PATH", Path(directory.name, "cfg")),
+            mock.patch.object(config, "CONFIG", config.Config()),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def add_card_raising(self, error):
+        with mock.patch.object(anki_utils, "invoke", side_effect=error):
+            anki_commands.WORKER._add_card(FakeEngine(), "hello")
+
+    def test_queued_when_anki_is_not_running(self):
+        self.add_card_raising(urllib.error.URLError(ConnectionRefusedError()))
+        self.outbox.enqueue.assert_called_once()
+
+    def test_queued_when_connecting_times_out(self):
+        # what urllib raises for a connect timeout
+        self.add_card_raising(urllib.error.URLError(socket.timeout("timed out")))
+        self.outbox.enqueue.assert_called_once()
+
+    def test_not_queued_when_anki_does_not_answer(self):
+        self.add_card_raising(socket.timeout("timed out"))
+        self.outbox.enqueue.assert_not_called()
+
+    def test_old_anki_section_migrated(self):
+        config.CONFIG_PATH.write_text("[anki]\nnote_type = Basic\n")
+        answers = {"modelNames": ["Basic"], "modelFieldNames": ["Front", "Back"]}
+        sent = []
+
+        def invoke(action, timeout=None, **params):
+            sent.append((action, params))
+            return answers.get(action)
+
+        with mock.patch.object(anki_utils, "invoke", side_effect=invoke):
+            anki_commands.WORKER._add_card(FakeEngine(), "hello")
+
+        (action, params) = sent[-1]
+        self.assertEqual(action, "guiAddCards")
+        self.assertEqual(params["note"]["modelName"], "Basic")
+        self.assertNotIn("[anki]", config.CONFIG_PATH.read_text())
+        self.assertEqual(config.CONFIG.get().add_to_anki.note_type, "Basic")
+
+    def test_old_anki_section_kept_when_anki_is_not_running(self):
+        config.CONFIG_PATH.write_text("[anki]\nnote_type = Basic\n")
+        with mock.patch.object(anki_commands.log, "warning"):
+            self.add_card_raising(urllib.error.URLError(ConnectionRefusedError()))
+
+        self.outbox.enqueue.assert_not_called()
+        self.assertIn("[anki]", config.CONFIG_PATH.read_text())
+
+
+if __name__ == "__main__":
+    unittest.main()
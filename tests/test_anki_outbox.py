@@ -0,0 +1,229 @@
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from pathlib import Path
+import socket
+import tempfile
+import threading
+from threading import Thread
+import time
+import unittest
+from unittest import mock
+
+from plover_cards import anki_outbox
+from plover_cards import anki_utils
+from plover_cards import config
+from plover_cards.commands import anki_commands
+
+Suggestion = namedtuple("Suggestion", "text steno_list")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class FakeAnkiConnect:
+    # answers like AnkiConnect on port, and can be started and stopped like anki
+    def __init__(self, port):
+        self.port = port
+        self.requests = []
+        # returned instead of a result when set
+        self.error = None
+        self.server = None
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):  # pylint: disable=invalid-name
+                request = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+                fake.requests.append(request)
+                if fake.error is not None:
+                    response = {"result": None, "error": fake.error}
+                elif request["action"] == "multi":
+                    results = [
+                        {"result": None, "error": None}
+                        for _ in request["params"]["actions"]
+                    ]
+                    response = {"result": results, "error": None}
+                else:
+                    response = {"result": None, "error": None}
+
+                body = json.dumps(response).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self.server = HTTPServer(("localhost", self.port), Handler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def sent(self):
+        # the actions sent in "multi" requests
+        return [
+            action
+            for request in self.requests
+            if request["action"] == "multi"
+            for action in request["params"]["actions"]
+        ]
+
+
+class FakeEngine:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get_suggestions(self, text):
+        return [Suggestion(text, [("HEL", "HRO")])]
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name, "anki_outbox.jsonl")
+
+        self.anki = FakeAnkiConnect(free_port())
+        self.addCleanup(self.anki.stop)
+
+        self.outbox = anki_outbox.Outbox()
+        for patch in (
+            mock.patch.object(anki_outbox.Outbox, "PATH", self.path),
+            mock.patch.object(anki_outbox, "MIN_BACKOFF", 0.05),
+            mock.patch.object(anki_outbox, "MAX_BACKOFF", 0.2),
+            mock.patch.object(anki_utils, "URL", f"http://localhost:{self.anki.port}"),
+            mock.patch.object(anki_commands, "OUTBOX", self.outbox),
+            mock.patch.object(config, "CONFIG_PATH", Path(directory.name, "cfg")),
+            mock.patch.object(config, "CONFIG", config.Config()),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.stop_outbox)
+        config.CONFIG_PATH.write_text(
+            "[add_to_anki]\ntranslation_field = Front\nstrokes_field = Back\n"
+        )
+
+    def stop_outbox(self):
+        self.outbox.stop()
+        if self.outbox.thread is not None:
+            self.outbox.thread.join(5)
+
+    def queued(self):
+        if not self.path.exists():
+            return []
+        return [json.loads(line) for line in self.path.read_text().splitlines()]
+
+    def test_queued_while_anki_is_down_then_sent(self):
+        anki_commands.WORKER._add_card(FakeEngine(), "hello")
+        anki_commands.WORKER._add_card(FakeEngine(), "world")
+
+        # added as notes, as each would replace the last in the add cards window
+        queued = self.queued()
+        self.assertEqual(
+            [request["action"] for request in queued], ["addNotes", "addNotes"]
+        )
+        self.assertEqual(
+            [request["params"]["notes"][0]["fields"] for request in queued],
+            [
+                {"Front": "hello", "Back": "HEL/HRO"},
+                {"Front": "world", "Back": "HEL/HRO"},
+            ],
+        )
+        self.assertEqual(len(self.outbox), 2)
+        self.assertTrue(self.outbox.running)
+
+        # still down after backing off a few times
+        time.sleep(0.3)
+        self.assertEqual(len(self.outbox), 2)
+
+        self.anki.start()
+        wait_for(lambda: len(self.outbox) == 0)
+        self.assertEqual(
+            [action["action"] for action in self.anki.sent()], ["addNotes", "addNotes"]
+        )
+        self.assertFalse(self.path.exists())
+
+    def test_keeps_trying_after_an_error(self):
+        self.anki.error = "collection is not available"
+        self.anki.start()
+        self.outbox.enqueue("addNotes", notes=[{"fields": {"Front": "hello"}}])
+
+        wait_for(lambda: len(self.anki.requests) >= 2)
+        self.assertTrue(self.outbox.thread.is_alive())
+        self.assertTrue(self.outbox.running)
+        self.assertEqual(len(self.outbox), 1)
+
+        self.anki.error = None
+        wait_for(lambda: len(self.outbox) == 0)
+        # the same note each time, until it was sent
+        self.assertEqual(
+            {action["action"] for action in self.anki.sent()}, {"addNotes"}
+        )
+        self.assertEqual(self.anki.requests[-1]["action"], "multi")
+
+    def test_sent_when_anki_comes_back_after_going_down(self):
+        self.anki.start()
+        self.outbox.enqueue("addNotes", notes=[{"fields": {"Front": "one"}}])
+        wait_for(lambda: len(self.outbox) == 0)
+
+        self.anki.stop()
+        self.outbox.enqueue("addNotes", notes=[{"fields": {"Front": "two"}}])
+        time.sleep(0.2)
+        self.assertEqual(len(self.queued()), 1)
+
+        self.anki.start()
+        wait_for(lambda: len(self.outbox) == 0)
+        self.assertEqual(
+            [
+                action["params"]["notes"][0]["fields"]["Front"]
+                for action in self.anki.sent()
+            ],
+            ["one", "two"],
+        )
+
+    def test_skips_a_cut_off_line(self):
+        self.path.write_text(
+            json.dumps(anki_utils.request("addNotes", notes=[])) + '\n{"action": "ad'
+        )
+        self.assertEqual(len(self.outbox), 1)
+
+    def test_restarts_after_the_thread_stops(self):
+        self.anki.start()
+        # the thread dies without going through its own error handling
+        with mock.patch.object(
+            anki_outbox.Outbox, "flush", side_effect=SystemExit
+        ), mock.patch.object(threading, "excepthook"):
+            self.outbox.start()
+            self.outbox.enqueue("addNotes", notes=[])
+            wait_for(lambda: not self.outbox.thread.is_alive())
+        self.assertFalse(self.outbox.running)
+
+        self.outbox.enqueue("addNotes", notes=[])
+        wait_for(lambda: len(self.outbox) == 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+from multiprocessing import resource_tracker
+import multiprocessing.spawn
+from pathlib import Path
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from plover_cards.card_builder import cards
+from plover_cards.plover_hook import card_suggestions as store
+from plover_cards.plover_hook import snapshot
+
+
+def write_snapshot(directory, count):
+    source_path = Path(directory, "suggestions.pickle")
+    source_path.write_bytes(b"")
+    # older than the snapshot
+    time.sleep(0.01)
+    path = Path(directory, "suggestions.snapshot")
+    suggestions = {
+        f"word{i:03d}": {
+            "frequency": i + 1,
+            "last_updated": 1600000000.0 + i,
+            "strokes": {f"W{i}": 2, f"W{i}/-D": 1},
+        }
+        for i in range(count)
+    }
+    snapshot.write(path, suggestions, store.VERSION, store.HISTORY_DAYS)
+
+    return (path, source_path, Path(directory, "suggestions.deleted"))
+
+
+@unittest.skipIf(shutil.which("false") is None, "needs a command which fails")
+class ProcessesTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.paths = write_snapshot(directory.name, 50)
+
+        for patch in (
+            mock.patch.object(cards, "PARALLEL_BUILD", True),
+            mock.patch.object(cards, "PARALLEL_MIN_ROWS", 1),
+            mock.patch.object(cards, "PARALLEL_CHUNK_ROWS", 10),
+            mock.patch.object(cards.os, "cpu_count", return_value=2),
+            mock.patch.object(cards, "_process_failures", {"count": 0}),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def create_cards(self):
+        # ignored phrases are deleted from the snapshot
+        snapshot.clear_deleted(self.paths[2])
+        card_suggestions = snapshot.Snapshot.open(*self.paths, store.VERSION)
+        self.addCleanup(card_suggestions.close)
+        # more than a pipe holds, which a process that exits straight away
+        # doesn't read
+        ignored = {"word001"}.union(f"other{i:05d}" for i in range(10000))
+        return cards.create_cards(card_suggestions, ignored, {})
+
+    def in_process(self):
+        with mock.patch.object(cards, "use_processes", return_value=False):
+            return self.create_cards()
+
+    def test_built_in_processes(self):
+        expected = self.in_process()
+
+        with mock.patch.object(
+            cards, "parallel_records", wraps=cards.parallel_records
+        ) as parallel_records:
+            self.assertEqual(self.create_cards(), expected)
+        parallel_records.assert_called_once()
+
+    def test_built_here_when_processes_cant_start(self):
+        expected = self.in_process()
+
+        # started with the real python first, so only the processes building
+        # cards fail
+        resource_tracker.ensure_running()
+        # every process exits straight away, which multiprocessing.Pool would
+        # keep replacing
+        self.addCleanup(
+            multiprocessing.spawn.set_executable, multiprocessing.spawn.get_executable()
+        )
+        multiprocessing.spawn.set_executable(shutil.which("false"))
+        with mock.patch.object(
+            cards, "parallel_records", wraps=cards.parallel_records
+        ) as parallel_records, mock.patch.object(cards.log, "error"):
+            for _ in range(cards.MAX_PROCESS_FAILURES + 1):
+                self.assertEqual(self.create_cards(), expected)
+
+        self.assertEqual(parallel_records.call_count, cards.MAX_PROCESS_FAILURES)
+
+
+if __name__ == "__main__":
+    unittest.main()
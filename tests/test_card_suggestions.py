@@ -0,0 +1,51 @@
+import unittest
+from unittest import mock
+
+from plover_cards.plover_hook import card_suggestions as store
+
+
+class AddStrokesTest(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(store, "MAX_STROKES", 3)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_most_suggested_then_shortest_first(self):
+        stroke_counts = store.add_strokes(
+            {}, ["KPA*/TKPWO", "TKPWO/-G", "TKPWO", "TKPWO"]
+        )
+        self.assertEqual(
+            list(stroke_counts.items()),
+            [("TKPWO", 2), ("TKPWO/-G", 1), ("KPA*/TKPWO", 1)],
+        )
+
+    def test_longest_of_the_least_suggested_evicted(self):
+        stroke_counts = store.add_strokes({}, ["TKPWO", "TKPWO", "KPA*/TKPWO"])
+        stroke_counts = store.add_strokes(stroke_counts, ["TKPWO/-G", "TKPWO/SKWR"])
+
+        # the new stroke takes over the evicted one's count
+        self.assertEqual(
+            list(stroke_counts.items()),
+            [("TKPWO", 2), ("TKPWO/SKWR", 2), ("TKPWO/-G", 1)],
+        )
+
+
+class MigrateTest(unittest.TestCase):
+    def test_capitalising_strokes_dropped_from_variants(self):
+        migrated = store.migrate(
+            {
+                "Go": {"frequency": 1, "last_updated": 2, "strokes": {"KPA*/TKPWO"}},
+                "go": {"frequency": 2, "last_updated": 1, "strokes": {"TKPWO"}},
+                "Plover": {"frequency": 1, "last_updated": 1, "strokes": {"PHRO*EFR"}},
+            },
+            1,
+        )
+
+        self.assertEqual(migrated["go"]["strokes"], {"TKPWO": 1})
+        self.assertEqual(migrated["go"]["variants"], {"go": 2, "Go": 1})
+        # the only way it's written
+        self.assertEqual(migrated["plover"]["strokes"], {"PHRO*EFR": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import configparser
+import unittest
+from unittest import mock
+
+from plover_cards import config
+from plover_cards.card_builder import cards
+from plover_cards.plover_hook import card_suggestions as store
+
+
+def record(i):
+    return (
+        f"word{i}",
+        [f"W{i}", f"W{i}/-D"],
+        [2, 1],
+        i % 3,
+        0,
+        0,
+        1600000000.0 + i,
+        None,
+        [f"word{i}s"] if i % 2 else [],
+    )
+
+
+def shown(all_cards):
+    return [
+        (
+            card.translation,
+            card.stroke_suggestions,
+            card.stroke_counts,
+            card.similar_ignored,
+            card.chosen_strokes,
+            card.ignored,
+        )
+        for card in all_cards
+    ]
+
+
+class CardsTest(unittest.TestCase):
+    def setUp(self):
+        parser = configparser.ConfigParser()
+        config.reset(parser)
+        parser["compare_ignore"]["enabled"] = "no"
+        self.cards = cards.Cards(config.parse(parser), store.CardSuggestions())
+        self.cards.append([record(i) for i in range(10)])
+        self.cards.sort_by(self.cards.frequency, reverse=True)
+
+        patch = mock.patch.object(cards, "MIN_ROWS_TO_COMPACT", 4)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_sort_descending_keeps_ties_in_order(self):
+        self.assertEqual(
+            [card.translation for card in self.cards],
+            [f"word{i}" for i in (2, 5, 8, 1, 4, 7, 0, 3, 6, 9)],
+        )
+
+    def test_removed_rows_are_dropped(self):
+        self.cards.choose_strokes(0, "W2")
+        self.cards.ignore(1)
+        self.cards.remove([3, 4, 5])
+        self.assertEqual(self.cards.num_rows, 10)
+
+        expected = shown(self.cards)
+        # as many unused rows as cards
+        self.cards.remove([5, 6])
+        del expected[5:7]
+
+        self.assertEqual(self.cards.num_rows, 5)
+        self.assertEqual(len(self.cards.stroke_offsets), 6)
+        self.assertEqual(len(self.cards.similar_ignored), 2)
+        self.assertEqual(shown(self.cards), expected)
+        self.assertEqual(self.cards[0].chosen_strokes, "W2")
+        self.assertTrue(self.cards[1].ignored)
+
+
+if __name__ == "__main__":
+    unittest.main()
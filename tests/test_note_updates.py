@@ -0,0 +1,113 @@
+import unittest
+from unittest import mock
+
+from plover_cards import anki_utils
+from plover_cards.card_builder.cards import (
+    compare_keys,
+    get_existing_notes,
+    get_note_updates,
+    normalise_field,
+    normalise_fields,
+)
+from plover_cards.plover_hook.card_suggestions import CardSuggestions
+
+
+def note(note_id, translation, strokes):
+    return {
+        "noteId": note_id,
+        "fields": {
+            "Front": {"value": translation, "order": 0},
+            "Back": {"value": strokes, "order": 1},
+        },
+    }
+
+
+class GetNoteUpdatesTest(unittest.TestCase):
+    def setUp(self):
+        self.card_suggestions = CardSuggestions()
+        self.card_suggestions.card_suggestions = {
+            "go": {"frequency": 1, "strokes": {"TKPWO": 1, "TKPWOE/-G": 1}},
+            "home": {"frequency": 1, "strokes": {"HOEPL": 1}},
+        }
+
+    def updates(self, notes):
+        return get_note_updates(
+            notes, get_existing_notes(notes, "Front"), "Back", self.card_suggestions
+        )
+
+    def test_adds_the_shorter_outline_before_the_field(self):
+        self.assertEqual(
+            self.updates([note(1, "go", "TKPWOE/-G<br>TKPWOEG <i>(old)</i>")]),
+            [(1, "TKPWO<br>TKPWOE/-G<br>TKPWOEG <i>(old)</i>")],
+        )
+
+    def test_not_updated_when_the_outline_is_already_there(self):
+        self.assertEqual(
+            self.updates([note(1, "go", "TKPWOE/-G, TKPWO"), note(2, "home", "")]),
+            [],
+        )
+
+    def test_updates_notes_with_html_in_the_compare_field(self):
+        self.assertEqual(
+            self.updates([note(1, "<b>Go</b>&nbsp;", "TKPWOE/-G")]),
+            [(1, "TKPWO<br>TKPWOE/-G")],
+        )
+
+
+class NormaliseTest(unittest.TestCase):
+    def test_fields_are_unescaped_once(self):
+        self.assertEqual(
+            get_existing_notes(
+                [note(1, "&amp;lt;", ""), note(2, "<b>go</b><br>home&nbsp;", "")],
+                "Front",
+            ),
+            ["&lt;", "go home"],
+        )
+
+    def test_each_tag_and_entity_replaced_once(self):
+        self.assertEqual(
+            normalise_fields(
+                [
+                    "caf&eacute;&#39;s<BR/>m&uuml;sli",
+                    "&copy<b>;",
+                    "1 < 2 &gt; 0",
+                    "a\xa0b",
+                ]
+            ),
+            ["café's müsli", "©;", "1 < 2 > 0", "a b"],
+        )
+        self.assertEqual(normalise_field("<i>go</i>&amp;lt;"), "go&lt;")
+
+    def test_phrases_keep_html(self):
+        self.assertEqual(compare_keys(["<div>", " Go &amp; "]), ["<div>", "go &amp;"])
+
+
+class InvokeMultiTest(unittest.TestCase):
+    def test_returns_the_errors_for_each_action(self):
+        actions = [
+            anki_utils.request("updateNoteFields", note={"id": i}) for i in range(3)
+        ]
+        results = [
+            {"result": None, "error": None},
+            {"result": None, "error": "note was not found: 1"},
+            {"result": None, "error": None},
+        ]
+
+        with mock.patch.object(anki_utils, "invoke", return_value=results):
+            self.assertEqual(
+                anki_utils.invoke_multi(actions),
+                (3, [(1, "note was not found: 1")]),
+            )
+
+    def test_stops_when_anki_stops_answering(self):
+        actions = [
+            anki_utils.request("updateNoteFields", note={"id": i}) for i in range(3)
+        ]
+        ok = {"result": None, "error": None}
+
+        with mock.patch.object(anki_utils, "invoke", side_effect=[[ok, ok], OSError()]):
+            self.assertEqual(anki_utils.invoke_multi(actions, batch_size=2), (2, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from plover_cards.card_builder import output_csv
+from plover_cards.card_builder.output_csv import OutputCsv
+
+
+class OutputCsvTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name, "output.csv")
+
+        for patch in (
+            mock.patch.object(
+                OutputCsv, "INDEX_PATH", Path(directory.name, "index.pickle")
+            ),
+            # rewritten whenever a note is replaced
+            mock.patch.object(output_csv, "MIN_ROWS_TO_COMPACT", 0),
+            mock.patch.object(output_csv, "MAX_ROWS_PER_NOTE", 1),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_keeps_the_encoding_of_an_older_file(self):
+        self.path.write_bytes('"café","KAEF"\n"naïve","TPHAOEUF"\n'.encode("cp1252"))
+
+        with mock.patch("locale.getpreferredencoding", return_value="cp1252"):
+            output = OutputCsv(self.path)
+            self.assertEqual(output.notes, {"café": "KAEF", "naïve": "TPHAOEUF"})
+            output.write([("café", "KA*EF")])
+
+        self.assertEqual(
+            self.path.read_bytes().decode("cp1252"),
+            '"café","KA*EF"\n"naïve","TPHAOEUF"\n',
+        )
+        self.assertEqual(OutputCsv(self.path).notes["café"], "KA*EF")
+
+    def test_changes_to_utf8_for_text_the_old_encoding_cant_write(self):
+        self.path.write_bytes('"café","KAEF"\n'.encode("cp1252"))
+
+        with mock.patch("locale.getpreferredencoding", return_value="cp1252"):
+            OutputCsv(self.path).write([("日本", "TPHEUP")])
+
+        self.assertEqual(
+            self.path.read_text(encoding="utf-8"),
+            '"café","KAEF"\n"日本","TPHEUP"\n',
+        )
+
+    def test_keeps_rows_which_arent_notes_when_compacting(self):
+        self.path.write_text(
+            '"Translation","Strokes","Tags"\n"go","TKPWO"\n"go","TKPWOE"\n',
+            encoding="utf-8",
+        )
+
+        OutputCsv(self.path).write([("home", "HOEPL")])
+
+        self.assertEqual(
+            self.path.read_text(encoding="utf-8"),
+            '"Translation","Strokes","Tags"\n"go","TKPWOE"\n"home","HOEPL"\n',
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
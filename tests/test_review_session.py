@@ -0,0 +1,102 @@
+import configparser
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from plover_cards import config
+from plover_cards.card_builder import cards
+from plover_cards.card_builder.session import ReviewSession
+from plover_cards.plover_hook import card_suggestions as store
+
+
+def suggestions(*phrases):
+    card_suggestions = store.CardSuggestions()
+    card_suggestions.card_suggestions = {
+        phrase: {
+            "frequency": 1,
+            "last_updated": 1600000000.0,
+            "strokes": {phrase.upper(): 1},
+        }
+        for phrase in phrases
+    }
+    return card_suggestions
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.ignore_path = Path(directory.name, "ignore.txt")
+
+        for patch in (
+            mock.patch.object(
+                ReviewSession, "PATH", Path(directory.name, "session.pickle")
+            ),
+            mock.patch.object(
+                ReviewSession, "JOURNAL_PATH", Path(directory.name, "session.jsonl")
+            ),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        parser = configparser.ConfigParser()
+        config.reset(parser)
+        parser["compare_ignore"]["file_path"] = str(self.ignore_path)
+        self.config = config.parse(parser)
+        self.store = suggestions("alpha", "beta", "gamma", "delta")
+        self.profile_keys = ["english"]
+
+    def open_cards(self):
+        return cards.Cards(self.config, self.store, ReviewSession(self.profile_keys))
+
+    def test_ignore_file_kept_when_resumed(self):
+        self.ignore_path.write_text("alpha")
+        built = self.open_cards()
+        self.assertEqual(
+            [card.translation for card in built], ["beta", "gamma", "delta"]
+        )
+
+        # added to the ignore file while the cards are open
+        self.ignore_path.write_text("alpha\nbeta")
+        built.remove(built.reload_ignored(self.store))
+        built.ignore(built.index("delta"))
+
+        # and after they're closed
+        self.ignore_path.write_text("alpha\nbeta\ngamma")
+        resumed = self.open_cards()
+        self.assertTrue(resumed.session.resumed)
+        self.assertEqual([card.translation for card in resumed], ["delta"])
+
+        resumed.save()
+        self.assertEqual(
+            self.ignore_path.read_text().splitlines(),
+            ["alpha", "beta", "delta", "gamma"],
+        )
+
+    def test_removed_cards_stay_removed(self):
+        self.ignore_path.write_text("alpha\nbeta")
+        built = self.open_cards()
+        self.ignore_path.write_text("alpha\nbeta\ngamma")
+        built.remove(built.reload_ignored(self.store))
+
+        # taken out of the ignore file again, before the hook deleted it
+        self.ignore_path.write_text("alpha")
+        self.store = suggestions("alpha", "beta", "gamma", "delta")
+        resumed = self.open_cards()
+        self.assertEqual([card.translation for card in resumed], ["delta"])
+
+    def test_started_again_for_another_profile(self):
+        built = self.open_cards()
+        built.ignore(0)
+
+        # the same settings, but plover's using another system
+        self.profile_keys = ["russian"]
+        self.store = suggestions("один", "два")
+        rebuilt = self.open_cards()
+        self.assertFalse(rebuilt.session.resumed)
+        self.assertEqual([card.translation for card in rebuilt], ["один", "два"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+from array import array
+from pathlib import Path
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from plover_cards.plover_hook import card_suggestions as store
+from plover_cards.plover_hook import profiles
+from plover_cards.plover_hook import snapshot
+
+SUGGESTIONS = {
+    "go": {
+        "frequency": 3,
+        "frequency_shorter": 1,
+        "last_updated": 1600000000.5,
+        "strokes": {"TKPWO": 2, "TKPWO/-G": 1},
+        "history": array("I", range(store.HISTORY_DAYS)),
+        "history_day": 19000,
+        "variants": {"go": 2, "Go": 1},
+    },
+    "café": {
+        "frequency": 1,
+        "last_updated": None,
+        "strokes": {},
+    },
+    "a\tb": {
+        "frequency": 2,
+        "frequency_shorter": 0,
+        "last_updated": 1600000001.0,
+        "strokes": {"AEU": 2},
+    },
+}
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.source_path = Path(self.directory, "suggestions.pickle")
+        self.source_path.write_bytes(b"")
+        # older than the snapshot
+        time.sleep(0.01)
+        self.path = Path(self.directory, "suggestions.snapshot")
+        self.deleted_path = Path(self.directory, "suggestions.deleted")
+
+    def open(self):
+        result = snapshot.Snapshot.open(
+            self.path, self.source_path, self.deleted_path, store.VERSION
+        )
+        if result is not None:
+            self.addCleanup(result.close)
+        return result
+
+    def test_round_trip(self):
+        snapshot.write(self.path, SUGGESTIONS, store.VERSION, store.HISTORY_DAYS)
+        result = self.open()
+
+        expected = {
+            phrase: dict(
+                {"frequency_shorter": 0, "last_updated": None},
+                **data,
+            )
+            for phrase, data in SUGGESTIONS.items()
+        }
+        self.assertEqual(dict(result.items()), expected)
+        # sorted by the utf-8 phrase
+        self.assertEqual(list(result.card_suggestions), ["a\tb", "café", "go"])
+        self.assertEqual(result.card_suggestions["café"], expected["café"])
+        self.assertNotIn("gone", result.card_suggestions)
+
+    def test_deleted(self):
+        snapshot.write(self.path, SUGGESTIONS, store.VERSION, store.HISTORY_DAYS)
+        self.open().delete("go")
+
+        result = self.open()
+        self.assertEqual(list(result.card_suggestions), ["a\tb", "café"])
+        self.assertEqual(len(result.card_suggestions), 2)
+
+    def test_out_of_date(self):
+        snapshot.write(self.path, SUGGESTIONS, store.VERSION, store.HISTORY_DAYS)
+        self.assertIsNone(
+            snapshot.Snapshot.open(
+                self.path, self.source_path, self.deleted_path, store.VERSION + 1
+            )
+        )
+
+        time.sleep(0.01)
+        self.source_path.write_bytes(b"")
+        self.assertIsNone(self.open())
+
+
+class StoreSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patch = mock.patch.object(profiles, "DIR", Path(directory.name))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.profile = profiles.Profile("English Stenotype", ("main.json",))
+
+    def test_written_when_closed(self):
+        card_suggestions = store.CardSuggestions(self.profile)
+        card_suggestions.card_suggestions = dict(SUGGESTIONS)
+        card_suggestions.changed = True
+        card_suggestions.close()
+
+        # opened without loading the store
+        with mock.patch.object(store.CardSuggestions, "load") as load:
+            result = store.read_only(self.profile)
+            self.addCleanup(result.close)
+        load.assert_not_called()
+        self.assertIsInstance(result, snapshot.Snapshot)
+        self.assertEqual(list(result.card_suggestions), ["a\tb", "café", "go"])
+
+
+if __name__ == "__main__":
+    unittest.main()